@@ -0,0 +1,336 @@
+"""Benchmark the download, cache and plotting hot paths against fake_wandb.
+
+Runs each scenario a few times on synthetic runs in a temporary cache
+directory, and writes the timings as JSON so results from different commits
+can be compared, e.g.
+
+```
+python bench.py --output before.json
+git checkout my-branch
+python bench.py --compare before.json
+```
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import typing
+from unittest import mock
+
+import core
+import fake_wandb
+import lazy
+import utils
+
+pd = lazy.lazy_import("pandas")
+
+_PROJECT = "bench/project"
+_SCENARIOS: dict[
+    str, tuple[typing.Callable[["Bench"], None] | None, typing.Callable[["Bench"], int]]
+] = {}
+
+
+def scenario(name: str, setup: typing.Callable[["Bench"], None] | None = None):
+    """Register a benchmark scenario.
+
+    Args:
+        name (str): Name of the scenario on the command line.
+        setup (typing.Callable[[Bench], None] | None): Called before the
+            scenario, not timed. Default None.
+
+    Returns:
+        Decorator registering a callable which takes a `Bench` and returns
+        the number of rows it processed.
+    """
+
+    def register(fn):
+        _SCENARIOS[name] = (setup, fn)
+        return fn
+
+    return register
+
+
+def cmd_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Benchmark hot paths against a fake wandb.")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        dest="scenarios",
+        choices=list(_SCENARIOS),
+        help="Scenario to run, can be given several times (default: all).",
+    )
+    parser.add_argument(
+        "--runs",
+        type=utils.validator_int_strict_positive("--runs"),
+        default=8,
+        help="Number of synthetic runs (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--steps",
+        type=utils.validator_int_strict_positive("--steps"),
+        default=5000,
+        help="History rows per run (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=utils.validator_int_strict_positive("--metrics"),
+        default=20,
+        help="Metric columns per run (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--sparsity",
+        type=float,
+        default=0.5,
+        help="Probability a metric is missing at a step (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--page-latency",
+        type=float,
+        default=0.0,
+        help="Seconds of simulated latency per page of results"
+        " (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--page-size",
+        type=utils.validator_int_strict_positive("--page-size"),
+        default=500,
+        help="Rows per `scan_history` page (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--grow",
+        type=utils.validator_int_strict_positive("--grow"),
+        default=200,
+        help="New rows per run for incremental scenarios (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--max-threads",
+        type=utils.validator_int_strict_positive("--max-threads"),
+        default=4,
+        help="Threads for `fetch_histories` (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        help="Worker processes for `fetch_histories`, 0 to parse on the"
+        " download threads (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=utils.validator_int_strict_positive("--repeat"),
+        default=3,
+        help="Times to run each scenario (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Write JSON results to this file rather than stdout.",
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="JSON results of an earlier benchmark to compare against.",
+    )
+    utils.add_log_level_arg(parser, default="warning")
+    return parser.parse_args()
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace, cache_dir: str):
+        """Fresh synthetic runs and an empty cache for one scenario repetition."""
+        self.args = args
+        self.runs = fake_wandb.make_runs(
+            args.runs,
+            project=_PROJECT,
+            num_steps=args.steps,
+            num_metrics=args.metrics,
+            sparsity=args.sparsity,
+            page_latency=args.page_latency,
+        )
+        self.manager = core.HistoryManager(cache_dir=cache_dir, _login=False)
+
+    def api(self) -> typing.ContextManager:
+        """Serve `self.runs` from `wandb.Api` while in this context."""
+        return mock.patch(
+            "wandb.Api",
+            functools.partial(
+                fake_wandb.FakeApi, self.runs, page_latency=self.args.page_latency
+            ),
+        )
+
+    def sync(self) -> list[pd.DataFrame]:
+        return self.manager.fetch_histories(
+            self.runs,
+            max_threads=self.args.max_threads,
+            page_size=self.args.page_size,
+            processes=self.args.processes,
+        )
+
+    def grow(self) -> None:
+        for run in self.runs:
+            run.grow(self.args.grow)
+
+
+def _sync(bench: Bench) -> None:
+    bench.frames = bench.sync()
+
+
+def _sync_and_grow(bench: Bench) -> None:
+    bench.sync()
+    bench.grow()
+
+
+def _load_data_df(bench: Bench) -> None:
+    bench.data_df = core.combine_histories(bench.runs, bench.sync())
+
+
+@scenario("cold_sync")
+def cold_sync(bench: Bench) -> int:
+    return sum(len(df) for df in bench.sync())
+
+
+@scenario("incremental_sync", setup=_sync_and_grow)
+def incremental_sync(bench: Bench) -> int:
+    bench.sync()
+    return bench.args.runs * bench.args.grow
+
+
+@scenario("watch_cycle", setup=_sync_and_grow)
+def watch_cycle(bench: Bench) -> int:
+    with bench.api():
+        runs = core.fetch_runs(_PROJECT, timeout=None)
+    bench.manager.fetch_histories(
+        runs,
+        max_threads=bench.args.max_threads,
+        page_size=bench.args.page_size,
+        processes=bench.args.processes,
+    )
+    return bench.args.runs * bench.args.grow
+
+
+@scenario("multi_run_plot", setup=_load_data_df)
+def multi_run_plot(bench: Bench) -> int:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    lines = core.LineGenerator(bench.runs, bench.data_df)
+    for metric in bench.runs[0].metrics[:4]:
+        fig, _ = core.plot_lines(lines(metric, window=100), title=metric)
+        plt.close(fig)
+    return bench.args.runs * bench.args.steps * 4
+
+
+@scenario("read_cache", setup=_sync)
+def read_cache(bench: Bench) -> int:
+    return sum(len(bench.manager.read_cache(run)) for run in bench.runs)
+
+
+@scenario("write_cache", setup=_sync)
+def write_cache(bench: Bench) -> int:
+    for run, df in zip(bench.runs, bench.frames):
+        bench.manager.write_cache(run, df)
+    return sum(len(df) for df in bench.frames)
+
+
+@scenario("smooth", setup=_load_data_df)
+def smooth(bench: Bench) -> int:
+    lines = core.LineGenerator(bench.runs, bench.data_df)
+    rows = 0
+    for metric in bench.runs[0].metrics:
+        for _, (index, _) in lines(metric, window=100):
+            rows += len(index)
+    return rows
+
+
+def run_scenario(name: str, args: argparse.Namespace) -> dict[str, typing.Any]:
+    setup, fn = _SCENARIOS[name]
+    times = []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            bench = Bench(args, cache_dir)
+            if setup is not None:
+                setup(bench)
+            start = time.perf_counter()
+            rows = fn(bench)
+            times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    return {
+        "scenario": name,
+        "times": times,
+        "min": min(times),
+        "median": median,
+        "rows": rows,
+        "rows_per_sec": rows / median if median > 0 else None,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict) -> str:
+    """Table of median times of `results` relative to `baseline`."""
+    before = {r["scenario"]: r["median"] for r in baseline["results"]}
+    header = ("Scenario", "Before", "After", "Ratio")
+    lines = ["{:<20} {:>12} {:>12} {:>8}".format(*header)]
+    for result in results["results"]:
+        old = before.get(result["scenario"])
+        ratio = "" if old is None else f"{result['median'] / old:.2f}"
+        lines.append(
+            "{:<20} {:>12} {:>12.4f} {:>8}".format(
+                result["scenario"],
+                "" if old is None else f"{old:.4f}",
+                result["median"],
+                ratio,
+            )
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    args = cmd_args()
+    logging.basicConfig(level=args.log_level)
+
+    params = {
+        k: v
+        for k, v in vars(args).items()
+        if k not in {"scenarios", "output", "compare", "log_level"}
+    }
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": params,
+        "results": [
+            run_scenario(name, args) for name in (args.scenarios or list(_SCENARIOS))
+        ],
+    }
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            print(compare(results, json.load(f)))
@@ -0,0 +1,83 @@
+"""Check cached run histories for damage and repair them."""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+import constants
+import core
+import lazy
+import utils
+
+wandb = lazy.lazy_import("wandb")
+
+
+def cmd_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Check cached run histories for damage.")
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="Refetch the damaged step ranges of each damaged cache from wandb.",
+    )
+    parser.add_argument(
+        "--paths",
+        nargs="+",
+        default=list(constants.Paths),
+        help="Projects to look for the runs of damaged caches in, in order"
+        " (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--skip-schema",
+        action="store_true",
+        help="Only check steps, which is faster, not for schema drift.",
+    )
+    parser.add_argument(
+        "--page-size",
+        type=utils.validator_int_strict_positive("--page-size"),
+        help="Number of rows to download per wandb query in `run.scan_history`",
+        default=100,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        help="Timeout for wandb API calls. "
+        "Wandb uses a default value if not specified.",
+        default=None,
+    )
+    utils.add_log_level_arg(parser, default="info")
+    return parser.parse_args()
+
+
+def find_run(
+    api: wandb.Api, run_id: str, paths: list[str]
+) -> wandb.apis.public.Run | None:
+    """The run with id `run_id` in the first of `paths` that has one."""
+    for path in paths:
+        try:
+            return api.run(f"{path}/{run_id}")
+        except (ValueError, wandb.errors.CommError):
+            continue
+    return None
+
+
+if __name__ == "__main__":
+    args = cmd_args()
+    logging.basicConfig(level=args.log_level)
+
+    downloader = core.HistoryManager(_login=args.repair)
+    reports = downloader.scan_cache_dir(check_schema=not args.skip_schema)
+    damaged = [report for report in reports if not report.ok]
+    for report in reports:
+        print(f"{report.run_id:>10} {report.rows:>10} {report.describe()}")
+    print(f"\n{len(damaged)} of {len(reports)} cached runs damaged.")
+
+    if args.repair and damaged:
+        api = wandb.Api(timeout=args.timeout)
+        for report in damaged:
+            run = find_run(api, report.run_id, args.paths)
+            if run is None:
+                logging.warning("Run %s not found in %s.", report.run_id, args.paths)
+                continue
+            after = downloader.repair_cache(run, page_size=args.page_size)
+            print(f"{report.run_id:>10} repaired: {after.describe()}")
@@ -1,8 +1,10 @@
-import constants
-
-import wandb
+from __future__ import annotations
 
+import constants
 import core
+import lazy
+
+wandb = lazy.lazy_import("wandb")
 
 
 class TabICLEval(core.DownloadConfig, name="tabicl-eval"):
@@ -1,27 +1,67 @@
+from __future__ import annotations
+
 import abc
 import concurrent.futures
+import contextlib
+import csv
+import datetime
+import hashlib
+import importlib
 import logging
+import multiprocessing
 import os
+import threading
+import time
+import types
 import typing
 
-import matplotlib.pyplot as plt
-import pandas as pd
 import platformdirs
-import tqdm.asyncio
-import wandb
+
+try:
+    import fcntl
+except ImportError:  # Windows, cache locking is disabled.
+    fcntl = None
+
+import derived
+import instrumentation
+import integrity
+import lazy
+
+if typing.TYPE_CHECKING:
+    import run_summaries
+
+pd = lazy.lazy_import("pandas")
+tqdm = lazy.lazy_import("tqdm")
+wandb = lazy.lazy_import("wandb")
 
 logger = logging.getLogger(__name__)
 
 _LineGeneratorYieldType = tuple[
-    wandb.apis.public.Run,
-    tuple[pd.Index, pd.Series],
+    "wandb.apis.public.Run",
+    tuple["pd.Index", "pd.Series"],
 ]
 # TODO(HE): Check this type hint.
 QueryFilterType = dict[str, "list[QueryFilterType] | QueryFilterType | str"]
-RunFilterType = typing.Callable[[wandb.apis.public.Run], bool]
+RunFilterType = typing.Callable[["wandb.apis.public.Run"], bool]
 
 _REGISTRY = {}
 
+# Key in `DataFrame.attrs` set to True on server-side sampled histories.
+SAMPLED = "sampled"
+
+# Seconds of `_runtime` per row of the rolled up system metrics.
+SYSTEM_RESOLUTIONS = (60, 10 * 60, 60 * 60)
+
+# Where to find the configs defined in this repo, as name -> "module:class".
+# Lets us list config names (e.g. for `download.py --help`) without importing
+# them. Configs defined elsewhere are registered when their class is created.
+_CONFIG_ENTRIES = {
+    "tabicl-eval": "configs:TabICLEval",
+    "tabicl-reproduction": "configs:TabICLReproduction",
+    "tabicl": "configs:TabICL",
+    "sota": "configs:SOTA",
+}
+
 # TODO(HE): Update LineConfigs and plotting functionality
 # TODO(HE): clean up exec async function (maybe use in fetch histories...?)
 
@@ -31,9 +71,13 @@ _REGISTRY = {}
 # on the other you don't need to modify core code to be able to run
 # your own config.
 class DownloadConfig(abc.ABC):
-    """Base class for download configs."""
+    """Base class for download configs.
+
+    `download_path` may be a list of paths, in which case runs are
+    listed from all of them concurrently.
+    """
 
-    download_path: str
+    download_path: str | list[str]
     read_timeout: int | None
 
     def __init_subclass__(cls, name: str, **kwargs):
@@ -53,6 +97,11 @@ class DownloadConfig(abc.ABC):
         return None
 
 
+def config_names() -> list[str]:
+    """Names of all known configs, without importing the modules defining them."""
+    return sorted(_REGISTRY.keys() | _CONFIG_ENTRIES.keys())
+
+
 def get_config(name: str) -> DownloadConfig:
     """Retrieve config by name from registry.
 
@@ -72,28 +121,48 @@ def get_config(name: str) -> DownloadConfig:
             ...
         ```
         Then this class can be retrieved by `get_config("my-name")`.
+        Configs in this repo should also be added to `_CONFIG_ENTRIES`, so
+        they can be found before their module is imported.
     """
+    if name not in _REGISTRY and name in _CONFIG_ENTRIES:
+        module, _, _ = _CONFIG_ENTRIES[name].partition(":")
+        importlib.import_module(module)
     try:
         return _REGISTRY[name]()
     except KeyError:
         raise ValueError(
-            f"Config with name {name} not found.\nHave configs:\n{sorted(_REGISTRY.keys())}."
+            f"Config with name {name} not found.\nHave configs:\n{config_names()}."
         )
 
 
+# Look back this far past the last refresh so runs updated while we were
+# listing, or with slightly skewed server clocks, are not missed.
+REFRESH_SLACK_SECONDS = 120
+
+
+def isoformat_utc(timestamp: float) -> str:
+    """`timestamp` as an ISO 8601 UTC time, as used in wandb `updatedAt` filters."""
+    return datetime.datetime.fromtimestamp(timestamp, datetime.UTC).strftime(
+        "%Y-%m-%dT%H:%M:%S"
+    )
+
+
 def fetch_runs(
-    path: str,
+    path: str | typing.Sequence[str],
     timeout: int | None,
     query_filter: QueryFilterType | None = None,
     run_filter: RunFilterType | None = None,
     per_page: int = 50,
+    summaries: run_summaries.SummaryStore | None = None,
 ) -> list[wandb.apis.public.Run]:
     """Download and filter wanbd runs.
 
     Thin wrapper around `wandb.apis.public.Api.runs`.
 
     Args:
-        path (str): Query runs from this path.
+        path (str | typing.Sequence[str]): Query runs from this path. If
+            several paths are given they are listed concurrently with the
+            same filters, see `fetch_runs_by_path`.
         timeout (int | None): timeout for wandb `Api.runs` call.
             If None, wanbd uses a default value.
         query_filter (QueryFilterType | None): MongoDB query to filter
@@ -101,25 +170,166 @@ def fetch_runs(
         run_filter (RunFilterType | None): Optional callable to filter
             runs after download. Faster to use `query_filter` if possible.
         per_page (int): per_page
+        summaries (run_summaries.SummaryStore | None): If given, runs are
+            listed with their summaries and configs, which replace the
+            store's table for `path` and `query_filter`. Every listed run is
+            captured, including those `run_filter` drops. Default None.
 
     Returns:
-        list[wandb.apis.public.Run]: Downloaded and filtered runs.
+        list[wandb.apis.public.Run]: Downloaded and filtered runs. With
+            several paths, the runs of each path in the order given.
+            Each run records its project in `run.project`.
     """
+    if not isinstance(path, str):
+        by_path = fetch_runs_by_path(
+            dict.fromkeys(path, query_filter),
+            timeout=timeout,
+            run_filter=run_filter,
+            per_page=per_page,
+            summaries=summaries,
+        )
+        return [run for runs in by_path.values() for run in runs]
+
     api = wandb.Api(timeout=timeout)
-    all_runs = api.runs(
-        path,
-        filters=query_filter,
-        per_page=per_page,
-    )
+    if summaries is None:
+        all_runs = api.runs(path, filters=query_filter, per_page=per_page)
+    else:
+        listed_at = time.time()
+        # Fetch summaries and configs with the listing, not a query per run.
+        all_runs = list(
+            api.runs(path, filters=query_filter, per_page=per_page, lazy=False)
+        )
+        summaries.update(
+            path,
+            all_runs,
+            query_filter=query_filter,
+            replace=True,
+            refreshed_at=listed_at,
+        )
     return (
         list(all_runs) if run_filter is None else list(filter(run_filter, all_runs))
     )
 
 
+def fetch_runs_by_path(
+    queries: typing.Mapping[str, QueryFilterType | None],
+    timeout: int | None,
+    run_filter: RunFilterType | None = None,
+    per_page: int = 50,
+    summaries: run_summaries.SummaryStore | None = None,
+) -> dict[str, list[wandb.apis.public.Run]]:
+    """Download and filter runs from several paths concurrently.
+
+    Each path is listed by `fetch_runs` on its own thread, so the total
+    latency is that of the slowest path rather than the sum.
+
+    Args:
+        queries (typing.Mapping[str, QueryFilterType | None]): Map from
+            path to the MongoDB query used to filter runs from that path.
+        timeout (int | None): timeout for wandb `Api.runs` calls.
+            If None, wanbd uses a default value.
+        run_filter (RunFilterType | None): Optional callable to filter
+            runs after download, applied to runs from every path.
+        per_page (int): per_page
+        summaries (run_summaries.SummaryStore | None): Store to capture
+            the summaries and configs of listed runs in. Default None.
+
+    Returns:
+        dict[str, list[wandb.apis.public.Run]]: Downloaded and filtered
+            runs for each path, in the order of `queries`.
+    """
+    if not queries:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        futures = {
+            path: executor.submit(
+                fetch_runs,
+                path=path,
+                timeout=timeout,
+                query_filter=query_filter,
+                run_filter=run_filter,
+                per_page=per_page,
+                summaries=summaries,
+            )
+            for path, query_filter in queries.items()
+        }
+        return {path: future.result() for path, future in futures.items()}
+
+
+def shard_runs(
+    runs: typing.Sequence[wandb.apis.public.Run], index: int, count: int
+) -> list[wandb.apis.public.Run]:
+    """Select the runs in shard `index` of `count`.
+
+    Runs are assigned to shards by a hash of their id, so processes that
+    list the same runs in any order agree on the split.
+
+    Args:
+        runs (typing.Sequence[wandb.apis.public.Run]): The runs to split.
+        index (int): Which shard to return, `0 <= index < count`.
+        count (int): Number of shards.
+
+    Returns:
+        list[wandb.apis.public.Run]: The runs in this shard, in their
+            original order.
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index must be in [0, {count}), got {index}.")
+    return [
+        run
+        for run in runs
+        if int(hashlib.sha1(run.id.encode()).hexdigest(), 16) % count == index
+    ]
+
+
+def _next_step(df: pd.DataFrame) -> int:
+    """The step after the last one in history `df`."""
+    return 0 if df.empty else int(df["_step"].max()) + 1
+
+
+def _last_line(f: typing.BinaryIO, start: int, block: int = 1 << 16) -> bytes:
+    """Last non-empty line of binary file `f` at or after offset `start`."""
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    position = end
+    tail = b""
+    while position > start:
+        position = max(start, position - block)
+        f.seek(position)
+        tail = f.read(end - position).rstrip(b"\n")
+        if b"\n" in tail:
+            break
+    return tail.rpartition(b"\n")[2]
+
+
+def _count_rows(path: str) -> int:
+    """Number of data rows in CSV file `path`."""
+    with open(path, "rb") as f:
+        return max(0, sum(1 for _ in f) - 1)
+
+
+def rollup_system_metrics(df: pd.DataFrame, resolution: float) -> pd.DataFrame:
+    """Mean of the numeric system metrics in `df` over `resolution` seconds.
+
+    Rows are bucketed by `_runtime`, which becomes the start of the bucket.
+    `_timestamp` is the time of the first sample in the bucket.
+    """
+    numeric = df.select_dtypes(include="number")
+    bucket = (numeric["_runtime"] // resolution * resolution).rename("_runtime")
+    grouped = numeric.drop(columns=["_runtime"]).groupby(bucket)
+    rolled = grouped.mean()
+    if "_timestamp" in numeric.columns:
+        rolled["_timestamp"] = grouped["_timestamp"].min()
+    return rolled.reset_index()
+
+
 class HistoryManager:
     def __init__(
         self,
         api_key: str | None = None,
+        derived_metrics: typing.Iterable[derived.DerivedMetric] | None = None,
+        cache_dir: str | None = None,
+        profile: bool = False,
         _login: bool = True,  # Set to False for testing, so tests don't access wandb.
     ):
         """Download runs and their history from Weights and Biases API.
@@ -133,11 +343,25 @@ class HistoryManager:
         Args:
             api_key (str | None): WandB API key. If None it is detected automatically
                 by `wandb.login`. Default None.
+            derived_metrics (typing.Iterable[derived.DerivedMetric] | None):
+                Metrics to compute from new history rows as they are ingested
+                and store alongside them in the cache. If None, use every
+                metric in the `derived` registry. Default None.
+            cache_dir (str | None): Directory to cache run histories in. If
+                None, a platform specific local cache directory. Default None.
+            profile (bool): Capture cProfile and tracemalloc data for each
+                download phase in `stats`. Default False.
         """
         if _login:
             wandb.login(host="https://fundamental.wandb.io", key=api_key)
-        self.cache_dir = os.path.join(platformdirs.user_cache_dir(), "viz", "run_data")
+        self.derived_metrics = (
+            derived.registered() if derived_metrics is None else list(derived_metrics)
+        )
+        if cache_dir is None:
+            cache_dir = os.path.join(platformdirs.user_cache_dir(), "viz", "run_data")
+        self.cache_dir = cache_dir
         os.makedirs(self.cache_dir, exist_ok=True)
+        self.stats = instrumentation.DownloadStats(profile=profile)
 
     def get_cache_path(self, run: wandb.apis.public.Run) -> str:
         """Path to cache location for history of `run`.
@@ -150,6 +374,39 @@ class HistoryManager:
         """
         return os.path.join(self.cache_dir, f"{run.id}.csv")
 
+    def get_preview_path(self, run: wandb.apis.public.Run) -> str:
+        """Path to the cached sampled preview of the history of `run`.
+
+        Kept apart from `get_cache_path` so sampled data is never read as,
+        or appended to, the full history.
+        """
+        return os.path.join(self.cache_dir, f"{run.id}.preview.csv")
+
+    @contextlib.contextmanager
+    def cache_lock(self, run: wandb.apis.public.Run) -> typing.Iterator[None]:
+        """Hold an exclusive advisory lock on the cache of `run`.
+
+        The lock is a `flock` on a `.lock` file next to the cache, so it
+        excludes other threads and processes, including on other machines
+        sharing the cache directory if the filesystem supports it. Anything
+        that reads, modifies and writes back a cache should hold it.
+        Plain reads don't need it as writes are atomic.
+
+        Args:
+            run (wandb.apis.public.Run): The run who's cache to lock.
+        """
+        if fcntl is None:
+            yield
+            return
+        lock_path = os.path.join(self.cache_dir, f"{run.id}.lock")
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
     def clear_cache(self, runs: wandb.apis.public.Run | list[wandb.apis.public.Run]):
         """Delete cached history data for `runs`.
 
@@ -159,10 +416,17 @@ class HistoryManager:
         if not isinstance(runs, list):
             runs = [runs]
         for run in runs:
-            try:
-                os.remove(self.get_cache_path(run))
-            except FileNotFoundError:
-                pass
+            with self.cache_lock(run):
+                try:
+                    os.remove(self.get_cache_path(run))
+                except FileNotFoundError:
+                    pass
+                try:
+                    os.remove(integrity.empty_ranges_path(self.get_cache_path(run)))
+                except FileNotFoundError:
+                    pass
+                self.clear_preview(run)
+                self.clear_system_metrics(run)
 
     def read_cache(self, run: wandb.apis.public.Run) -> pd.DataFrame:
         """Read cached history data for `run`.
@@ -179,14 +443,19 @@ class HistoryManager:
         run_data_path = self.get_cache_path(run)
         if not os.path.exists(run_data_path):
             raise ValueError(f"No cached data found at path {run_data_path}.")
-        # TODO(HE): Fix bad cache lines
+        # Damaged caches can be found and repaired with `repair_cache`.
         logger.debug("Reading cache from %s.", run_data_path)
-        return pd.read_csv(run_data_path, on_bad_lines="warn")
+        with self.stats.phase(instrumentation.CACHE_READ, run.id):
+            df = pd.read_csv(run_data_path, on_bad_lines="warn")
+        self.stats.add(run.id, bytes_read=os.path.getsize(run_data_path))
+        return df
 
     def write_cache(self, run: wandb.apis.public.Run, df: pd.DataFrame) -> None:
         """Write to CSV cache for `run`. This overwrites existing cache data.
 
-        We do not write the index of `df`.
+        We do not write the index of `df`. The data is written to a temporary
+        file which then replaces the cache, so readers never see a partly
+        written cache. Hold `cache_lock` if `df` was derived from the cache.
 
         We assume that the data in the cache does not have columns of mixed dtype.
         For instance, pandas will read ints in a column as strings if the first
@@ -197,9 +466,185 @@ class HistoryManager:
                 Cached data lives at `.get_cache_path(run)` locally.
             df (pd.DataFrame): The data to write. No checks are performed.
         """
-        cache_path = self.get_cache_path(run)
+        self._write_csv(run, self.get_cache_path(run), df)
+
+    def _write_csv(
+        self, run: wandb.apis.public.Run, cache_path: str, df: pd.DataFrame
+    ) -> None:
         logging.debug("Writing cache at %s.", cache_path)
-        return df.to_csv(cache_path, index=False)
+        with self.stats.phase(instrumentation.CACHE_WRITE, run.id):
+            with integrity.atomic_write(cache_path, prefix=f".{run.id}.") as f:
+                df.to_csv(f, index=False)
+        self.stats.add(run.id, bytes_written=os.path.getsize(cache_path))
+
+    def scan_cache(
+        self, run: wandb.apis.public.Run, check_schema: bool = True
+    ) -> integrity.CacheReport:
+        """Check the cache of `run` for damage, see `integrity.scan_cache_file`.
+
+        Raises:
+            ValueError: No cache data found for `run`.
+        """
+        cache_path = self.get_cache_path(run)
+        if not os.path.exists(cache_path):
+            raise ValueError(f"No cached data found at path {cache_path}.")
+        return integrity.scan_cache_file(cache_path, check_schema=check_schema)
+
+    def scan_cache_dir(self, check_schema: bool = True) -> list[integrity.CacheReport]:
+        """Check every cached history in `cache_dir` for damage.
+
+        Only needs the files, not the runs, so works offline.
+        """
+        return [
+            integrity.scan_cache_file(
+                os.path.join(self.cache_dir, name), check_schema=check_schema
+            )
+            for name in sorted(os.listdir(self.cache_dir))
+            # Previews and system metrics are `<id>.<kind>.csv`.
+            if name.endswith(".csv")
+            and "." not in name.removesuffix(".csv")
+            and not name.startswith(".")
+        ]
+
+    def repair_cache(
+        self, run: wandb.apis.public.Run, page_size: int = 50
+    ) -> integrity.CacheReport:
+        """Repair the cache of `run` by refetching only the damaged step ranges.
+
+        Rows in the ranges given by `CacheReport.repair_ranges` are dropped
+        and replaced by a `scan_history` of just those steps. Derived metrics
+        are recomputed over the spliced history. A cache without a `_step`
+        column can't be spliced and is downloaded again in full.
+
+        Args:
+            run (wandb.apis.public.Run): The run who's cache to repair.
+            page_size (int): Number of rows of history to collect per
+                internal query in `run.scan_history`.
+
+        Returns:
+            integrity.CacheReport: Report of the cache after repair.
+
+        Raises:
+            ValueError: No cache data found for `run`.
+        """
+        cache_path = self.get_cache_path(run)
+        with self.cache_lock(run):
+            report = self.scan_cache(run)
+            if report.ok:
+                return report
+            logger.info("Repairing cache of run %s: %s.", run.id, report.describe())
+            if report.missing_step_column:
+                os.remove(cache_path)
+                self._fetch_history(run, page_size=page_size, update_cache=True)
+                return self.scan_cache(run)
+
+            ranges = report.repair_ranges()
+            cached = pd.read_csv(cache_path, on_bad_lines="skip", low_memory=False)
+            cached = cached.assign(
+                _step=pd.to_numeric(cached["_step"], errors="coerce")
+            ).dropna(subset=["_step"])
+            # Columns pandas made up for lines with too many fields.
+            unnamed = [c for c in cached.columns if str(c).startswith("Unnamed: ")]
+            derived_names = [m.name for m in self.derived_metrics]
+            damaged = pd.Series(False, index=cached.index)
+            for lo, hi in ranges:
+                damaged |= cached["_step"].between(lo, hi)
+            rows = []
+            for lo, hi in ranges:
+                rows.extend(
+                    self.scan_history(
+                        run, min_step=lo, max_step=hi + 1, page_size=page_size
+                    )
+                )
+            logger.info(
+                "Refetched %d rows in %d ranges for run %s.",
+                len(rows),
+                len(ranges),
+                run.id,
+            )
+            # Steps the server has nothing for were never logged, e.g. with
+            # explicit `wandb.log(step=...)`, rather than lost.
+            returned = [(row["_step"], row["_step"]) for row in rows]
+            empty = integrity.subtract_ranges(
+                ranges, integrity.merge_ranges(returned)
+            )
+            if empty:
+                integrity.add_empty_ranges(cache_path, empty)
+            self.stats.add(run.id, rows=len(rows))
+            with self.stats.phase(instrumentation.PARSE, run.id):
+                refetched = pd.DataFrame(rows).map(
+                    lambda x: float("nan") if x is None else x
+                )
+                data = (
+                    pd.concat([cached[~damaged], refetched], axis=0)
+                    .drop(columns=unnamed)
+                    .drop(columns=derived_names, errors="ignore")
+                    .astype({"_step": int})
+                    .sort_values("_step", kind="stable")
+                    .drop_duplicates("_step", keep="last")
+                    .reset_index(drop=True)
+                )
+                data = derived.add_derived_columns(data, None, self.derived_metrics)
+            self.write_cache(run, data)
+            return self.scan_cache(run)
+
+    def scan_history(
+        self,
+        run: wandb.apis.public.Run,
+        min_step: int,
+        max_step: int | None = None,
+        page_size: int = 50,
+        max_retries: int = 2,
+    ) -> list[dict[str, typing.Any]]:
+        """Collect `run.scan_history` rows, resuming after communication errors.
+
+        If the scan fails part way, it is restarted after the last step
+        received rather than from `min_step`.
+
+        Args:
+            run (wandb.apis.public.Run): The run.
+            min_step (int): First step to fetch.
+            max_step (int | None): Fetch steps before this one. If None,
+                fetch to the end of the history. Default None.
+            page_size (int): Number of rows of history to collect per
+                internal query in `run.scan_history`.
+            max_retries (int): How many times to resume after a
+                `wandb.errors.CommError`. Default 2.
+
+        Returns:
+            list[dict[str, typing.Any]]: The history rows.
+
+        Raises:
+            wandb.errors.CommError: If the scan fails more than
+                `max_retries` times.
+        """
+        rows = []
+        retries = 0
+        with self.stats.phase(instrumentation.NETWORK, run.id):
+            while True:
+                start = min_step if not rows else rows[-1]["_step"] + 1
+                try:
+                    rows.extend(
+                        run.scan_history(
+                            min_step=start,
+                            max_step=max_step,
+                            page_size=page_size,
+                        )
+                    )
+                    break
+                except wandb.errors.CommError:
+                    if retries >= max_retries:
+                        raise
+                    retries += 1
+                    logger.warning(
+                        "Error scanning history of run %s, retrying (%d/%d).",
+                        run.id,
+                        retries,
+                        max_retries,
+                        exc_info=True,
+                    )
+        self.stats.add(run.id, retries=retries)
+        return rows
 
     def fetch_history(
         self,
@@ -210,7 +655,10 @@ class HistoryManager:
         """Fetch entire history for single run and cache results.
 
         Loads data from cache if it exists, then appends more recent
-        data and saves the cache again.
+        data and saves the cache again, holding `cache_lock` throughout.
+        Derived metrics are computed for the new rows only, and backfilled
+        over the cached rows if a metric was added since the cache was
+        written.
 
         Args:
             run (wandb.apis.public.Run): The run.
@@ -222,12 +670,21 @@ class HistoryManager:
         Returns:
             pd.DataFrame: History of the run.
         """
+        if not update_cache:
+            return self._fetch_history(run, page_size=page_size, update_cache=False)
+        with self.cache_lock(run):
+            return self._fetch_history(run, page_size=page_size, update_cache=True)
+
+    def _fetch_history(
+        self,
+        run: wandb.apis.public.Run,
+        page_size: int,
+        update_cache: bool,
+    ) -> pd.DataFrame:
         last_history_step = run.lastHistoryStep
-        cache_path = self.get_cache_path(run)
-        if os.path.exists(cache_path):
-            cached = self.read_cache(run)
-            start_step = cached["_step"].max() + 1
-            if start_step > last_history_step:
+        cached, start_step = self._load_for_update(run, update_cache)
+        if start_step > last_history_step:
+            if cached is not None:
                 logger.debug(
                     "Cached data has max step %d and run.lastHistoryStep=%d. "
                     "Nothing to update returning cached data.",
@@ -235,81 +692,660 @@ class HistoryManager:
                     last_history_step,
                 )
                 return cached
-        else:
-            logger.debug("No cached data found at %s", cache_path)
-            cached = None
-            start_step = 0
-
-        expected_rows = last_history_step - start_step + 1
 
         logger.debug(
             "Scan history from step %d with page size %d. Expecting %d new rows.",
             start_step,
             page_size,
-            expected_rows,
+            last_history_step - start_step + 1,
         )
-        new_history = pd.DataFrame(
-            list(
-                run.scan_history(
-                    min_step=start_step,
-                    max_step=None,
-                    page_size=page_size,
-                )
+        rows = self.scan_history(run, min_step=start_step, page_size=page_size)
+        return self._merge_rows(run, rows, start_step, cached, update_cache)
+
+    def _load_for_update(
+        self, run: wandb.apis.public.Run, update_cache: bool
+    ) -> tuple[pd.DataFrame | None, int]:
+        """Cached history of `run`, with derived metrics backfilled, and next step."""
+        cache_path = self.get_cache_path(run)
+        if not os.path.exists(cache_path):
+            logger.debug("No cached data found at %s", cache_path)
+            return None, 0
+        cached = self.read_cache(run)
+        backfill = derived.missing_columns(cached, self.derived_metrics)
+        if backfill:
+            logger.debug(
+                "Backfilling derived metrics %s for cached data.",
+                [m.name for m in backfill],
             )
-        ).map(lambda x: float("nan") if x is None else x)
+            cached = derived.add_derived_columns(cached, None, backfill)
+            if update_cache:
+                self.write_cache(run, cached)
+        return cached, _next_step(cached)
 
-        # Account for wandb sometimes returning too many rows.
-        logger.debug(
-            "Scan history returned %d new rows, expected "
-            "%d (could change slightly if a step happens "
-            "between logging calls).",
-            new_history.shape[0],
-            expected_rows,
-        )
-        logger.debug("Defensively selecting rows in requested range from result.")
-        new_history = new_history.query("_step>=@start_step")
+    def _merge_rows(
+        self,
+        run: wandb.apis.public.Run,
+        rows: list[dict[str, typing.Any]],
+        start_step: int,
+        cached: pd.DataFrame | None,
+        update_cache: bool,
+    ) -> pd.DataFrame:
+        """Append history `rows` from `start_step` on to `cached` and cache them."""
+        with self.stats.phase(instrumentation.PARSE, run.id):
+            new_history = pd.DataFrame(rows).map(
+                lambda x: float("nan") if x is None else x
+            )
+            if new_history.empty:
+                new_history = pd.DataFrame({"_step": pd.Series(dtype="int64")})
 
-        data = (
-            new_history
-            if cached is None
-            else pd.concat([cached, new_history], axis=0).reset_index(drop=True)
-        )
+            # Account for wandb sometimes returning too many rows.
+            logger.debug(
+                "Scan history returned %d new rows (could change slightly if a"
+                " step happens between logging calls).",
+                new_history.shape[0],
+            )
+            logger.debug("Defensively selecting rows in requested range from result.")
+            new_history = new_history.query("_step>=@start_step")
+            new_history = derived.add_derived_columns(
+                new_history, cached, self.derived_metrics
+            )
+
+            data = (
+                new_history
+                if cached is None
+                else pd.concat([cached, new_history], axis=0).reset_index(drop=True)
+            )
+        self.stats.add(run.id, rows=new_history.shape[0])
         if update_cache:
             self.write_cache(run, data)
+            self.clear_preview(run)
+            # The scan is complete up to its last row, so steps missing from
+            # it were never logged, e.g. with explicit `wandb.log(step=...)`.
+            empty = integrity.step_gaps(new_history["_step"], start=start_step)
+            if empty:
+                integrity.add_empty_ranges(self.get_cache_path(run), empty)
         return data
 
+    def _cached_state(self, run: wandb.apis.public.Run) -> tuple[list[str], int] | None:
+        """Columns and next step of the cache of `run`, None if there is no cache.
+
+        Reads only the first and last lines, so is cheap however long the
+        history. Falls back to parsing `_step` if the last line is damaged.
+        """
+        cache_path = self.get_cache_path(run)
+        try:
+            with open(cache_path, "rb") as f:
+                header = f.readline()
+                last = _last_line(f, start=len(header))
+        except FileNotFoundError:
+            return None
+        columns = next(csv.reader([header.decode()]), [])
+        if "_step" not in columns:
+            # Damaged, let the full read report it.
+            return columns, 0
+        if not last:
+            return columns, 0
+        try:
+            values = next(csv.reader([last.decode()]))
+            return columns, int(float(values[columns.index("_step")])) + 1
+        except (ValueError, IndexError, StopIteration, UnicodeDecodeError):
+            steps = pd.read_csv(cache_path, usecols=["_step"], on_bad_lines="skip")
+            return columns, _next_step(steps)
+
+    def fetch_preview(
+        self,
+        run: wandb.apis.public.Run,
+        samples: int = 500,
+        update_cache: bool = True,
+    ) -> pd.DataFrame:
+        """Fetch a server-side sampled history of `run`, for a quick first look.
+
+        Uses `run.history(samples=samples)`, a single request however long
+        the run. The result has `attrs[SAMPLED]` set to True and is cached
+        at `get_preview_path(run)`, apart from the full history.
+
+        Args:
+            run (wandb.apis.public.Run): The run.
+            samples (int): Number of rows to sample. Default 500.
+            update_cache (bool): Whether to cache the preview. Default True.
+
+        Returns:
+            pd.DataFrame: Sampled history of the run.
+        """
+        with self.stats.phase(instrumentation.NETWORK, run.id):
+            sampled = run.history(samples=samples, pandas=True)
+        with self.stats.phase(instrumentation.PARSE, run.id):
+            preview = sampled.map(lambda x: float("nan") if x is None else x)
+            if preview.empty:
+                # Nothing logged yet.
+                preview = pd.DataFrame({"_step": pd.Series(dtype="int64")})
+            preview = derived.add_derived_columns(preview, None, self.derived_metrics)
+        if update_cache:
+            self._write_csv(run, self.get_preview_path(run), preview)
+        preview.attrs[SAMPLED] = True
+        return preview
+
+    def read_preview(self, run: wandb.apis.public.Run) -> pd.DataFrame:
+        """Read the cached sampled preview of `run`, see `fetch_preview`.
+
+        Raises:
+            ValueError: No cached preview found for `run`.
+        """
+        preview_path = self.get_preview_path(run)
+        if not os.path.exists(preview_path):
+            raise ValueError(f"No cached preview found at path {preview_path}.")
+        preview = pd.read_csv(preview_path)
+        preview.attrs[SAMPLED] = True
+        return preview
+
+    def clear_preview(self, run: wandb.apis.public.Run) -> None:
+        """Delete the cached sampled preview of `run`, if there is one."""
+        try:
+            os.remove(self.get_preview_path(run))
+        except FileNotFoundError:
+            pass
+
+    def fetch_histories_progressive(
+        self,
+        runs: typing.Sequence[wandb.apis.public.Run],
+        samples: int = 500,
+        max_threads: int | None = None,
+        page_size: int = 50,
+    ) -> ProgressiveHistories:
+        """Get usable histories of `runs` quickly, then full ones in the background.
+
+        Runs with a cached full history start from that. The others start
+        from a sampled preview, fetched for all runs in parallel before this
+        returns. Full histories are then fetched in the background and
+        replace the previews in the cache as they complete.
+
+        Args:
+            runs (typing.Sequence[wandb.apis.public.Run]): The runs.
+            samples (int): Number of rows per sampled preview. Default 500.
+            max_threads (int | None): Maximum number of threads for
+                downloads. Default None, the `ThreadPoolExecutor` default.
+            page_size (int): Number of rows of history to collect per
+                internal query in `run.scan_history`.
+
+        Returns:
+            ProgressiveHistories: The histories so far, see its methods.
+        """
+        unique_runs = list({run.id: run for run in runs}.values())
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_threads)
+
+        def first_look(run):
+            if os.path.exists(self.get_cache_path(run)):
+                return self.read_cache(run)
+            return self.fetch_preview(run, samples=samples)
+
+        initial = dict(
+            zip(
+                [run.id for run in unique_runs],
+                tqdm.tqdm(
+                    executor.map(first_look, unique_runs),
+                    total=len(unique_runs),
+                    desc="Fetching previews",
+                ),
+            )
+        )
+        full = {
+            run.id: executor.submit(self.fetch_history, run, page_size=page_size)
+            for run in unique_runs
+        }
+        executor.shutdown(wait=False)
+        return ProgressiveHistories(runs, initial, full)
+
     def fetch_histories(
         self,
         runs: typing.Sequence[wandb.apis.public.Run],
         max_threads: int | None = None,
         page_size: int = 50,
         update_cache: bool = True,
+        processes: int = 0,
+        return_data: bool = True,
+    ) -> list[pd.DataFrame] | None:
+        """Fetch the histories of `runs` concurrently, see `fetch_history`.
+
+        With `processes`, download threads only fetch raw history rows and
+        hold the cache locks. Building the DataFrames, merging them with the
+        cache, derived metrics and cache writes run in a pool of worker
+        processes, so they don't compete with the downloads for the GIL.
+        At most two jobs per process are queued; threads with rows ready
+        wait for a slot. Worth it for large syncs, where parsing dominates.
+
+        Args:
+            runs (typing.Sequence[wandb.apis.public.Run]): The runs.
+                Duplicates are fetched once.
+            max_threads (int | None): Maximum number of download threads.
+                Default None, the `ThreadPoolExecutor` default.
+            page_size (int): Number of rows of history to collect per
+                internal query in `run.scan_history`.
+            update_cache (bool): Whether to update local cached run
+                data with additional data downloaded. Default True.
+            processes (int): Number of worker processes to parse and write
+                in. If 0, download threads do it themselves. Default 0.
+            return_data (bool): Whether to return the histories. Without
+                them, workers needn't send the histories back and runs
+                with nothing new are skipped. Default True.
+
+        Returns:
+            list[pd.DataFrame] | None: Histories in the order of `runs`, or
+                None if not `return_data`.
+        """
+        # Duplicates are safe thanks to the cache lock, but wasteful.
+        unique_runs = list({run.id: run for run in runs}.values())
+        if len(unique_runs) < len(runs):
+            logger.debug(
+                "Fetching %d duplicate runs once.", len(runs) - len(unique_runs)
+            )
+        with contextlib.ExitStack() as stack:
+            if processes:
+                pool = stack.enter_context(
+                    concurrent.futures.ProcessPoolExecutor(
+                        max_workers=processes,
+                        # Forking a process with running threads can deadlock.
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                )
+                slots = threading.BoundedSemaphore(2 * processes)
+
+                def fetch(run):
+                    return self._fetch_history_in_pool(
+                        run, pool, slots, page_size, update_cache, return_data
+                    )
+
+            else:
+
+                def fetch(run):
+                    return self.fetch_history(
+                        run, page_size=page_size, update_cache=update_cache
+                    )
+
+            executor = stack.enter_context(
+                concurrent.futures.ThreadPoolExecutor(max_workers=max_threads)
+            )
+            histories = dict(
+                zip(
+                    [run.id for run in unique_runs],
+                    tqdm.tqdm(
+                        executor.map(fetch, unique_runs),
+                        total=len(unique_runs),
+                        desc="Fetching run histories",
+                    ),
+                )
+            )
+        if not return_data:
+            return None
+        return [histories[run.id] for run in runs]
+
+    def _fetch_history_in_pool(
+        self,
+        run: wandb.apis.public.Run,
+        pool: concurrent.futures.Executor,
+        slots: threading.Semaphore,
+        page_size: int,
+        update_cache: bool,
+        return_data: bool,
+    ) -> pd.DataFrame | None:
+        """`fetch_history`, with everything but the download done in `pool`."""
+        with contextlib.ExitStack() as stack:
+            if update_cache:
+                # Held until the worker has written the cache.
+                stack.enter_context(self.cache_lock(run))
+            state = self._cached_state(run)
+            start_step = 0 if state is None else state[1]
+            needs_backfill = state is not None and bool(
+                derived.missing_columns(
+                    pd.DataFrame(columns=state[0]), self.derived_metrics
+                )
+            )
+            if state is not None and start_step > run.lastHistoryStep:
+                if not needs_backfill:
+                    # Up to date, nothing for a worker to do.
+                    return self.read_cache(run) if return_data else None
+                rows = []
+            else:
+                rows = self.scan_history(run, min_step=start_step, page_size=page_size)
+
+            slots.acquire()
+            try:
+                data, counters = pool.submit(
+                    _merge_in_worker,
+                    self.cache_dir,
+                    self.derived_metrics,
+                    run.id,
+                    rows,
+                    start_step,
+                    update_cache,
+                    return_data,
+                ).result()
+            finally:
+                slots.release()
+        self.stats.add(run.id, **counters)
+        return data
+
+    def get_system_path(
+        self, run: wandb.apis.public.Run, resolution: float | None = None
+    ) -> str:
+        """Path to the cached system metrics of `run`.
+
+        Args:
+            run (wandb.apis.public.Run): The run.
+            resolution (float | None): Seconds per row of a rollup, see
+                `SYSTEM_RESOLUTIONS`. If None, the raw samples. Default None.
+        """
+        if resolution is None:
+            return os.path.join(self.cache_dir, f"{run.id}.system.csv")
+        return os.path.join(self.cache_dir, f"{run.id}.system.{resolution:g}s.csv")
+
+    def get_sampled_system_path(self, run: wandb.apis.public.Run) -> str:
+        """Path to the cached server-sampled system metrics of `run`.
+
+        Used instead of the raw samples once a run has more than the
+        `samples` asked for, see `fetch_system_metrics`.
+        """
+        return os.path.join(self.cache_dir, f"{run.id}.system.sampled.csv")
+
+    def fetch_system_metrics(
+        self,
+        run: wandb.apis.public.Run,
+        samples: int = 100_000,
+        update_cache: bool = True,
+    ) -> pd.DataFrame:
+        """Fetch the system metrics of `run`, e.g. GPU utilisation and memory.
+
+        wandb can't fetch only new system samples, so every call downloads
+        the run's whole system stream with `run.history(stream="system")`
+        and gets slower as the run gets longer. Only the cache is updated
+        incrementally: samples newer than the cached ones are appended, and
+        the rollups at each of `SYSTEM_RESOLUTIONS` are recomputed from the
+        first bucket with new samples onwards. Samples are indexed by
+        `_runtime`, like the history, so the two can be plotted together.
+
+        Once a run has `samples` or more samples the server returns them
+        evenly sampled down. Those are not raw: they replace the raw
+        samples in the cache, at `get_sampled_system_path(run)`, the
+        rollups are recomputed from them and the result has
+        `attrs[SAMPLED]` set. Raise `samples` to keep raw samples longer.
+
+        Args:
+            run (wandb.apis.public.Run): The run.
+            samples (int): Most samples to ask the server for. Default
+                100000, over two weeks at the default sampling interval.
+            update_cache (bool): Whether to update the cached samples and
+                rollups. Default True.
+
+        Returns:
+            pd.DataFrame: System metrics, sorted by `_timestamp`.
+        """
+        with self.stats.phase(instrumentation.NETWORK, run.id):
+            rows = run.history(samples=samples, pandas=False, stream="system")
+        sampled = len(rows) >= samples
+        with self.cache_lock(run):
+            raw_path = self.get_system_path(run)
+            cached = None
+            if not sampled and os.path.exists(raw_path):
+                with self.stats.phase(instrumentation.CACHE_READ, run.id):
+                    cached = pd.read_csv(raw_path)
+            with self.stats.phase(instrumentation.PARSE, run.id):
+                new = pd.DataFrame.from_records(rows).map(
+                    lambda x: float("nan") if x is None else x
+                )
+                if new.empty:
+                    return pd.DataFrame() if cached is None else cached
+                new = new.sort_values("_timestamp")
+                if cached is not None and not cached.empty:
+                    new = new[new["_timestamp"] > cached["_timestamp"].max()]
+                    data = pd.concat([cached, new], axis=0).reset_index(drop=True)
+                else:
+                    data = new.reset_index(drop=True)
+            self.stats.add(run.id, rows=len(new))
+            if update_cache and sampled:
+                logger.warning(
+                    "Run %s has at least %d system metrics samples, caching"
+                    " server-sampled ones instead of raw samples.",
+                    run.id,
+                    samples,
+                )
+                self._write_csv(run, self.get_sampled_system_path(run), data)
+                try:
+                    os.remove(raw_path)
+                except FileNotFoundError:
+                    pass
+                self._update_system_rollups(run, data, data["_runtime"].min())
+            elif update_cache and not new.empty:
+                self._write_csv(run, raw_path, data)
+                self._update_system_rollups(run, data, new["_runtime"].min())
+        if sampled:
+            data.attrs[SAMPLED] = True
+        return data
+
+    def _update_system_rollups(
+        self, run: wandb.apis.public.Run, data: pd.DataFrame, since: float
+    ) -> None:
+        """Recompute the rollups of system metrics `data` from `_runtime` `since`."""
+        for resolution in SYSTEM_RESOLUTIONS:
+            path = self.get_system_path(run, resolution)
+            start = since // resolution * resolution
+            with self.stats.phase(instrumentation.PARSE, run.id):
+                if os.path.exists(path):
+                    kept = pd.read_csv(path)
+                    kept = kept[kept["_runtime"] < start]
+                    tail = rollup_system_metrics(
+                        data[data["_runtime"] >= start], resolution
+                    )
+                    rolled = pd.concat([kept, tail], axis=0).reset_index(drop=True)
+                else:
+                    rolled = rollup_system_metrics(data, resolution)
+            self._write_csv(run, path, rolled)
+
+    def read_system_metrics(
+        self,
+        run: wandb.apis.public.Run,
+        resolution: float | None = None,
+        max_points: int | None = None,
+    ) -> pd.DataFrame:
+        """Read cached system metrics of `run`, see `fetch_system_metrics`.
+
+        Args:
+            run (wandb.apis.public.Run): The run.
+            resolution (float | None): Read the rollup at this many seconds
+                per row, one of `SYSTEM_RESOLUTIONS`. If None, the raw
+                samples, unless `max_points` is given. Default None.
+            max_points (int | None): Read the finest of the raw samples and
+                the rollups with at most this many rows, or the coarsest
+                rollup if none is small enough. Ignored if `resolution` is
+                given. Default None.
+
+        Returns:
+            pd.DataFrame: System metrics. `attrs["resolution"]` holds the
+                seconds per row, None for raw samples. `attrs[SAMPLED]` is
+                set if the finest samples are server-sampled, see
+                `fetch_system_metrics`.
+
+        Raises:
+            ValueError: No cached system metrics found for `run`.
+        """
+        def system_path(resolution):
+            path = self.get_system_path(run, resolution)
+            if resolution is None and not os.path.exists(path):
+                return self.get_sampled_system_path(run)
+            return path
+
+        if resolution is None and max_points is not None:
+            for resolution in (None, *SYSTEM_RESOLUTIONS):
+                path = system_path(resolution)
+                if os.path.exists(path) and _count_rows(path) <= max_points:
+                    break
+        path = system_path(resolution)
+        if not os.path.exists(path):
+            raise ValueError(f"No cached system metrics found at path {path}.")
+        with self.stats.phase(instrumentation.CACHE_READ, run.id):
+            df = pd.read_csv(path)
+        self.stats.add(run.id, bytes_read=os.path.getsize(path))
+        df.attrs["resolution"] = resolution
+        if os.path.exists(self.get_sampled_system_path(run)):
+            df.attrs[SAMPLED] = True
+        return df
+
+    def clear_system_metrics(self, run: wandb.apis.public.Run) -> None:
+        """Delete the cached system metrics of `run` and their rollups."""
+        paths = [self.get_system_path(run, r) for r in (None, *SYSTEM_RESOLUTIONS)]
+        for path in [*paths, self.get_sampled_system_path(run)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def fetch_all_system_metrics(
+        self,
+        runs: typing.Sequence[wandb.apis.public.Run],
+        max_threads: int | None = None,
+        samples: int = 100_000,
     ) -> list[pd.DataFrame]:
-        # Runs must not contain duplicates. Could cause issue in cache read/write.
-        unique_run_ids = {run.id for run in runs}
-        if len(unique_run_ids) < len(runs):
-            raise ValueError("Detected duplicate runs.")
+        """`fetch_system_metrics` for each of `runs`, concurrently."""
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
             return list(
                 tqdm.tqdm(
                     executor.map(
-                        lambda run: self.fetch_history(
-                            run,
-                            page_size=page_size,
-                            update_cache=update_cache,
-                        ),
+                        lambda run: self.fetch_system_metrics(run, samples=samples),
                         runs,
                     ),
                     total=len(runs),
-                    desc="Fetching run histories",
+                    desc="Fetching system metrics",
                 )
             )
 
 
+def _merge_in_worker(
+    cache_dir: str,
+    derived_metrics: list[derived.DerivedMetric],
+    run_id: str,
+    rows: list[dict[str, typing.Any]],
+    start_step: int,
+    update_cache: bool,
+    return_data: bool,
+) -> tuple[pd.DataFrame | None, dict[str, float]]:
+    """Merge new history `rows` of a run into its cache, in a worker process.
+
+    The parent holds the cache lock. Rows before the end of the cache, e.g.
+    if it grew since the parent looked, are dropped.
+
+    Returns:
+        tuple[pd.DataFrame | None, dict[str, float]]: The history, if
+            `return_data`, and the counters recorded in the worker's stats.
+    """
+    manager = HistoryManager(
+        derived_metrics=derived_metrics, cache_dir=cache_dir, _login=False
+    )
+    # Only the id of the run is used.
+    run = types.SimpleNamespace(id=run_id)
+    cached, next_step = manager._load_for_update(run, update_cache)
+    if cached is not None and not rows:
+        # Only a backfill, which `_load_for_update` already wrote.
+        data = cached
+    else:
+        data = manager._merge_rows(
+            run, rows, max(start_step, next_step), cached, update_cache
+        )
+    return (data if return_data else None), dict(manager.stats.runs[run_id])
+
+
+class ProgressiveHistories:
+    def __init__(
+        self,
+        runs: typing.Sequence[wandb.apis.public.Run],
+        initial: dict[str, pd.DataFrame],
+        full: dict[str, concurrent.futures.Future],
+    ):
+        """Histories that start sampled and are replaced by full ones as they arrive.
+
+        Made by `HistoryManager.fetch_histories_progressive`.
+        """
+        self.runs = list(runs)
+        self._initial = initial
+        self._full = full
+
+    def current(self, run: wandb.apis.public.Run) -> pd.DataFrame:
+        """Full history of `run` if it has arrived, else the initial one.
+
+        Check `sampled(run)`, or `attrs[SAMPLED]` of the result, to tell
+        whether it is a sampled preview.
+        """
+        future = self._full[run.id]
+        if future.done() and future.exception() is None:
+            return future.result()
+        return self._initial[run.id]
+
+    def sampled(self, run: wandb.apis.public.Run) -> bool:
+        """Whether `current(run)` is a sampled preview."""
+        return self.current(run).attrs.get(SAMPLED, False)
+
+    def done(self) -> bool:
+        """Whether all full histories have arrived or failed."""
+        return all(future.done() for future in self._full.values())
+
+    def all_current(self) -> list[pd.DataFrame]:
+        """`current` for every run, in order."""
+        return [self.current(run) for run in self.runs]
+
+    def data_df(self) -> pd.DataFrame:
+        """`combine_histories` of the current histories, for `LineGenerator`."""
+        return combine_histories(self.runs, self.all_current())
+
+    def wait(self, timeout: float | None = None) -> list[pd.DataFrame]:
+        """Wait for the full histories of all runs and return them in order.
+
+        Raises:
+            Exception: Whatever a failed full download raised.
+            TimeoutError: If `timeout` seconds pass first.
+        """
+        concurrent.futures.wait(self._full.values(), timeout=timeout)
+        return [self._full[run.id].result(timeout=0) for run in self.runs]
+
+
+def combine_histories(
+    runs: typing.Sequence[wandb.apis.public.Run],
+    histories: typing.Sequence[pd.DataFrame],
+) -> pd.DataFrame:
+    """Histories of `runs` in one frame, for `LineGenerator`.
+
+    The frame is indexed by `_step` with columns `(run.name, metric)`.
+    pandas drops the `attrs` of frames it combines, so the ids of runs whose
+    history is sampled are kept in `attrs[SAMPLED]` of the result instead.
+    """
+    data_df = pd.concat(
+        {run.name: df.set_index("_step") for run, df in zip(runs, histories)},
+        axis=1,
+    )
+    data_df.attrs[SAMPLED] = [
+        run.id for run, df in zip(runs, histories) if df.attrs.get(SAMPLED, False)
+    ]
+    return data_df
+
+
 class LineGenerator:
-    def __init__(self, runs: list[wandb.apis.public.Run], data_df: pd.DataFrame):
+    def __init__(
+        self,
+        runs: list[wandb.apis.public.Run],
+        data_df: pd.DataFrame,
+        sampled: typing.Collection[str] | None = None,
+    ):
+        """Smoothed lines of a metric for each of `runs`, for `plot_lines`.
+
+        Args:
+            runs (list[wandb.apis.public.Run]): The runs.
+            data_df (pd.DataFrame): Histories with columns
+                `(run.name, metric)`, see `combine_histories`.
+            sampled (typing.Collection[str] | None): Ids of runs whose
+                history is sampled. Their lines have `attrs[SAMPLED]` set.
+                If None, taken from `data_df.attrs[SAMPLED]`. Default None.
+        """
         self.runs = runs
         self.data_df = data_df
+        if sampled is None:
+            sampled = data_df.attrs.get(SAMPLED, ())
+        self.sampled = set(sampled)
 
     def smooth(
         self,
@@ -343,20 +1379,22 @@ class LineGenerator:
                 to_plot = self.smooth(
                     raw, window=window, min_periods=min_periods, **smooth_kwds
                 )
+                if run.id in self.sampled:
+                    to_plot.attrs[SAMPLED] = True
                 yield run, (to_plot.index, to_plot)
 
 
 def plot_lines(lines: typing.Iterable[_LineGeneratorYieldType], title: str):
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(1)
     for run, args in lines:
         stub = "(*) " if run.state == "running" else ""
-        ax.plot(*args, label=stub + run.name)
+        if args[1].attrs.get(SAMPLED, False):
+            # Previews must never pass for full histories.
+            ax.plot(*args, label=f"{stub}{run.name} (sampled)", linestyle="--")
+        else:
+            ax.plot(*args, label=stub + run.name)
     ax.set_title(title)
     ax.legend(loc="best")
     return fig, ax
-
-
-# TODO(HE): Is there a better way of doing this?
-# Need to import configs here to compile the classes
-# and populate the registry.
-import configs  # noqa: F401, E402, E501  # pylint: disable=unused-import, wrong-import-position
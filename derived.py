@@ -0,0 +1,205 @@
+"""Metrics derived from logged history columns.
+
+Derived metrics are computed by `core.HistoryManager` when new history rows
+are ingested and are stored as extra columns in the local cache, so they can be
+plotted like any raw metric.
+"""
+
+from __future__ import annotations
+
+import abc
+import typing
+
+import constants
+import lazy
+
+pd = lazy.lazy_import("pandas")
+
+_REGISTRY: dict[str, "DerivedMetric"] = {}
+
+
+class DerivedMetric(abc.ABC):
+    """Base class for a metric computed from other columns of a run's history.
+
+    Subclasses implement `compute`, which must only look at `new` and, where
+    the metric depends on earlier rows (e.g. running maxima), at the previously
+    computed values in `previous`. This lets the history manager extend the
+    derived column as new steps arrive without recomputing the whole history.
+    """
+
+    def __init__(self, name: str, inputs: typing.Sequence[str]):
+        self.name = name
+        self.inputs = list(inputs)
+
+    def available(self, df: pd.DataFrame) -> bool:
+        """Whether `df` has any of the columns this metric is computed from."""
+        return any(col in df.columns for col in self.inputs)
+
+    def applies(self, new: pd.DataFrame, previous: pd.DataFrame | None) -> bool:
+        """Whether to compute this metric for the rows of `new`.
+
+        By default if `new` has any of its inputs. Metrics that carry
+        earlier values forward also apply when only `previous` has them.
+        """
+        return self.available(new)
+
+    @abc.abstractmethod
+    def compute(self, new: pd.DataFrame, previous: pd.DataFrame | None) -> pd.Series:
+        """Compute the derived metric for the rows of `new`.
+
+        Args:
+            new (pd.DataFrame): Newly ingested history rows.
+            previous (pd.DataFrame | None): Previously ingested history
+                rows, including this metric's column if it was computed
+                before. None if there is no earlier data.
+
+        Returns:
+            pd.Series: The derived metric, aligned with the index of `new`.
+        """
+
+
+class WeightedMean(DerivedMetric):
+    """Weighted mean of several columns, ignoring missing values per row.
+
+    Rows where none of the inputs are logged are NaN.
+    """
+
+    def __init__(
+        self, name: str, inputs: typing.Sequence[str], weights: typing.Sequence[float]
+    ):
+        if len(inputs) != len(weights):
+            raise ValueError(
+                f"Got {len(inputs)} inputs but {len(weights)} weights for {name}."
+            )
+        super().__init__(name, inputs)
+        self.weights = list(weights)
+
+    def compute(self, new: pd.DataFrame, previous: pd.DataFrame | None) -> pd.Series:
+        values = new.reindex(columns=self.inputs).apply(pd.to_numeric, errors="coerce")
+        weights = pd.Series(self.weights, index=self.inputs)
+        present = values.notna()
+        total = values.fillna(0.0).mul(weights, axis=1).sum(axis=1)
+        norm = present.mul(weights, axis=1).sum(axis=1)
+        return (total / norm).where(present.any(axis=1))
+
+
+class Ratio(DerivedMetric):
+    """Ratio of two columns, `numerator / denominator`."""
+
+    def __init__(self, name: str, numerator: str, denominator: str):
+        super().__init__(name, [numerator, denominator])
+        self.numerator = numerator
+        self.denominator = denominator
+
+    def available(self, df: pd.DataFrame) -> bool:
+        return self.numerator in df.columns and self.denominator in df.columns
+
+    def compute(self, new: pd.DataFrame, previous: pd.DataFrame | None) -> pd.Series:
+        denominator = new[self.denominator].astype(float)
+        return new[self.numerator].astype(float) / denominator.where(denominator != 0)
+
+
+class CumulativeMax(DerivedMetric):
+    """Running maximum of a column, carried forward over steps where it isn't logged."""
+
+    def __init__(self, name: str, column: str):
+        super().__init__(name, [column])
+        self.column = column
+
+    def applies(self, new: pd.DataFrame, previous: pd.DataFrame | None) -> bool:
+        return self.available(new) or (
+            previous is not None and self.name in previous.columns
+        )
+
+    def compute(self, new: pd.DataFrame, previous: pd.DataFrame | None) -> pd.Series:
+        if self.column in new.columns:
+            running = new[self.column].astype(float).cummax().ffill()
+        else:
+            running = pd.Series(float("nan"), index=new.index)
+        if previous is not None and self.name in previous.columns:
+            prev_max = previous[self.name].max()
+            if pd.notna(prev_max):
+                running = running.clip(lower=prev_max).fillna(prev_max)
+        return running
+
+
+def register(metric: DerivedMetric) -> DerivedMetric:
+    """Add `metric` to the registry of derived metrics computed at ingest.
+
+    Args:
+        metric (DerivedMetric): The metric. Its name must not clash with
+            another registered metric.
+
+    Returns:
+        DerivedMetric: `metric`, so this can be used inline.
+
+    Raises:
+        ValueError: If a metric with the same name is already registered.
+    """
+    if metric.name in _REGISTRY:
+        raise ValueError(f"Derived metric {metric.name} is already registered.")
+    _REGISTRY[metric.name] = metric
+    return metric
+
+
+def registered() -> list[DerivedMetric]:
+    """All registered derived metrics, in registration order."""
+    return list(_REGISTRY.values())
+
+
+def add_derived_columns(
+    new: pd.DataFrame,
+    previous: pd.DataFrame | None,
+    metrics: typing.Iterable[DerivedMetric],
+) -> pd.DataFrame:
+    """Return `new` with a column for each of `metrics` whose inputs are present.
+
+    Metrics are skipped unless `DerivedMetric.applies`, usually when none of
+    their inputs appear in `new`, so runs that never log a metric don't gain
+    an all-NaN column.
+
+    Args:
+        new (pd.DataFrame): Newly ingested history rows.
+        previous (pd.DataFrame | None): Earlier history rows, see
+            `DerivedMetric.compute`.
+        metrics (typing.Iterable[DerivedMetric]): Metrics to compute.
+
+    Returns:
+        pd.DataFrame: `new` with derived columns added or replaced.
+    """
+    out = new
+    for metric in metrics:
+        # Assign one at a time so metrics can be derived from earlier ones.
+        if metric.applies(out, previous):
+            out = out.assign(**{metric.name: metric.compute(out, previous)})
+    return out
+
+
+def missing_columns(
+    df: pd.DataFrame, metrics: typing.Iterable[DerivedMetric]
+) -> list[DerivedMetric]:
+    """Metrics that can be computed for `df` but don't have a column yet."""
+    return [m for m in metrics if m.name not in df.columns and m.available(df)]
+
+
+# Weighted offline eval scores, see `constants.offline_eval_num_context_probs`.
+register(
+    WeightedMean(
+        "derived/offline_eval weighted score",
+        constants.MetricNames.OfflineEval.eip_score_by_ctx,
+        constants.offline_eval_num_context_probs,
+    )
+)
+register(
+    WeightedMean(
+        "derived/offline_eval weighted accuracy",
+        constants.MetricNames.OfflineEval.eip_acc_by_ctx,
+        constants.offline_eval_num_context_probs,
+    )
+)
+register(
+    CumulativeMax(
+        "derived/offline_eval weighted score best",
+        "derived/offline_eval weighted score",
+    )
+)
@@ -3,11 +3,14 @@
 import argparse
 import logging
 
-import tqdm
-
 import core
+import instrumentation
+import lazy
+import run_summaries
 import utils
 
+tqdm = lazy.lazy_import("tqdm")
+
 
 def cmd_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser("Download data from wandb.")
@@ -19,7 +22,7 @@ def cmd_args() -> argparse.Namespace:
             " Define your class like MyConfig(core.DownloadConfig, name='my-name')"
             " and it will become available as an argument here."
         ),
-        choices=list(core._REGISTRY.keys()),
+        choices=core.config_names(),
     )
     parser.add_argument(
         "--clear-cache",
@@ -38,6 +41,50 @@ def cmd_args() -> argparse.Namespace:
         default=1,
         help="Maximum number of concurrent threads for download.",
     )
+    parser.add_argument(
+        "--processes",
+        type=utils.validator_int_strict_positive("--processes"),
+        default=None,
+        help="Parse and write histories in this many worker processes, leaving"
+        " the download threads to only download. Helps large downloads on"
+        " many threads (default: parse on the download threads).",
+    )
+    parser.add_argument(
+        "--shard",
+        type=utils.parse_shard,
+        default=None,
+        metavar="i/N",
+        help="Only download shard i of N (0 <= i < N) of the config's runs, so"
+        " several processes or machines sharing the cache can split a download.",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="Write download timings and counters as JSON to PATH, '-' for stdout.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar="DIR",
+        help="Write cProfile and tracemalloc data for each download phase to DIR."
+        " Phases are only profiled while no other phase is, so use with"
+        " --max-threads 1 for complete profiles.",
+    )
+    parser.add_argument(
+        "--system-metrics",
+        action="store_true",
+        help="Also download system metrics (GPU utilisation, memory, ...) and"
+        " cache them with rollups, see `HistoryManager.fetch_system_metrics`.",
+    )
+    parser.add_argument(
+        "--summaries",
+        action="store_true",
+        help="Also capture the summaries, configs and tags of listed runs in the"
+        " local summary store, see `run_summaries.py`.",
+    )
     utils.add_log_level_arg(parser, default="info")
     return parser.parse_args()
 
@@ -49,20 +96,29 @@ if __name__ == "__main__":
 
     cfg = core.get_config(args.name)
 
-    downloader = core.HistoryManager()
+    downloader = core.HistoryManager(profile=args.profile is not None)
     logging.info("Downloading runs for config %s.", args.name)
-    runs = core.fetch_runs(
-        path=cfg.download_path,
-        timeout=cfg.read_timeout,
-        query_filter=cfg.query_filter(),
-        run_filter=cfg.run_filter(),
-    )
+    with downloader.stats.phase(instrumentation.LISTING):
+        runs = core.fetch_runs(
+            path=cfg.download_path,
+            timeout=cfg.read_timeout,
+            query_filter=cfg.query_filter(),
+            run_filter=cfg.run_filter(),
+            summaries=(
+                run_summaries.SummaryStore(timeout=cfg.read_timeout)
+                if args.summaries
+                else None
+            ),
+        )
+    if args.shard is not None:
+        runs = core.shard_runs(runs, *args.shard)
+        logging.info("Selected %d runs in shard %d/%d.", len(runs), *args.shard)
     logging.info("Collected runs with ids %s", [r.id for r in runs])
     if args.clear_cache:
         logging.info("Clearing cached data for selected runs.")
         downloader.clear_cache(runs)
 
-    if args.max_threads == 1:
+    if args.max_threads == 1 and args.processes is None:
         logging.info("Downloading run data.")
         for run in tqdm.tqdm(runs, desc="Downloading data"):
             downloader.fetch_history(
@@ -76,4 +132,15 @@ if __name__ == "__main__":
             max_threads=args.max_threads,
             page_size=args.page_size,
             update_cache=True,
+            processes=args.processes or 0,
+            return_data=False,
         )
+    if args.system_metrics:
+        logging.info("Downloading system metrics.")
+        downloader.fetch_all_system_metrics(runs, max_threads=args.max_threads)
+
+    logging.info("Download stats: %s", downloader.stats.to_json())
+    if args.metrics_json is not None:
+        downloader.stats.write_json(args.metrics_json)
+    if args.profile is not None:
+        downloader.stats.dump_profiles(args.profile)
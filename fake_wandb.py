@@ -0,0 +1,206 @@
+"""Local stand-in for the parts of the wandb public API that we use.
+
+Runs have synthetic, deterministic histories of configurable length, width and
+sparsity, and every page of results can be delayed to mimic server latency.
+Used by `bench.py` and the tests so neither needs the live server.
+"""
+
+from __future__ import annotations
+
+import random
+import time
+import types
+import typing
+
+import lazy
+
+pd = lazy.lazy_import("pandas")
+
+METRIC_PREFIX = "metric_"
+SECONDS_PER_STEP = 0.5
+
+
+class FakeRun:
+    def __init__(
+        self,
+        run_id: str,
+        num_steps: int = 1000,
+        num_metrics: int = 10,
+        sparsity: float = 0.0,
+        page_latency: float = 0.0,
+        project: str = "bench/project",
+        name: str | None = None,
+        state: str = "running",
+        tags: typing.Sequence[str] = (),
+        username: str = "bench",
+        seed: int = 0,
+        system_interval: float = 15.0,
+    ):
+        """Run with a synthetic history.
+
+        Args:
+            run_id (str): The run id.
+            num_steps (int): Number of history rows, steps `0..num_steps-1`.
+                Default 1000.
+            num_metrics (int): Number of metric columns besides `_step`,
+                `_runtime` and `_timestamp`. Default 10.
+            sparsity (float): Probability that a metric is not logged at a
+                step, in which case its value is None. Default 0.
+            page_latency (float): Seconds to sleep before returning each
+                page of `scan_history`. Default 0.
+            project (str): Path of the project the run belongs to.
+            name (str | None): Display name. Defaults to `run_id`.
+            state (str): Run state. Default "running".
+            tags (typing.Sequence[str]): Run tags.
+            username (str): Username of the run's owner.
+            seed (int): Seed for the synthetic metric values.
+            system_interval (float): Seconds of `_runtime` between system
+                metrics samples. Default 15, as wandb.
+        """
+        self.id = run_id
+        self.name = run_id if name is None else name
+        self.project = project
+        self.state = state
+        self.tags = list(tags)
+        self.user = types.SimpleNamespace(name=username, username=username)
+        self.num_steps = num_steps
+        self.metrics = [f"{METRIC_PREFIX}{i}" for i in range(num_metrics)]
+        self.sparsity = sparsity
+        self.page_latency = page_latency
+        self.seed = seed
+        self.system_interval = system_interval
+
+    @property
+    def lastHistoryStep(self) -> int:  # noqa: N802
+        return self.num_steps - 1
+
+    @property
+    def summary_metrics(self) -> dict[str, typing.Any]:
+        """The last logged value of each metric, as `Run.summary_metrics`."""
+        summary = {}
+        for step in range(self.num_steps - 1, -1, -1):
+            for key, value in self.row(step).items():
+                if value is not None:
+                    summary.setdefault(key, value)
+            if len(summary) == len(self.metrics) + 3:
+                break
+        return summary
+
+    @property
+    def config(self) -> dict[str, typing.Any]:
+        return {"seed": self.seed, "model": {"num_metrics": len(self.metrics)}}
+
+    def grow(self, steps: int) -> None:
+        """Log `steps` more history rows."""
+        self.num_steps += steps
+
+    def row(self, step: int) -> dict[str, typing.Any]:
+        """The history row logged at `step`."""
+        rng = random.Random(self.seed * 1_000_003 + step)
+        runtime = step * SECONDS_PER_STEP
+        row = {"_step": step, "_runtime": runtime, "_timestamp": 1.7e9 + runtime}
+        for metric in self.metrics:
+            value = rng.random()
+            row[metric] = None if rng.random() < self.sparsity else value
+        return row
+
+    def scan_history(
+        self,
+        keys: list[str] | None = None,
+        page_size: int = 1000,
+        min_step: int = 0,
+        max_step: int | None = None,
+    ) -> typing.Iterator[dict[str, typing.Any]]:
+        """Rows with `min_step <= _step < max_step`, as `Run.scan_history`."""
+        if max_step is None or max_step > self.lastHistoryStep:
+            max_step = self.lastHistoryStep + 1
+        for page_start in range(min_step, max_step, page_size):
+            time.sleep(self.page_latency)
+            for step in range(page_start, min(page_start + page_size, max_step)):
+                row = self.row(step)
+                if keys is not None:
+                    row = {k: row[k] for k in ["_step", *keys]}
+                yield row
+
+    def system_row(self, index: int) -> dict[str, typing.Any]:
+        """The `index`th system metrics sample."""
+        rng = random.Random(-(self.seed * 1_000_003 + index) - 1)
+        runtime = index * self.system_interval
+        return {
+            "_runtime": runtime,
+            "_timestamp": 1.7e9 + runtime,
+            "system.cpu": rng.uniform(0, 100),
+            "system.gpu.0.gpu": rng.uniform(0, 100),
+            "system.gpu.0.memoryAllocated": rng.uniform(0, 100),
+        }
+
+    def history(
+        self, samples: int = 500, pandas: bool = True, stream: str = "default"
+    ) -> list[dict[str, typing.Any]] | pd.DataFrame:
+        """At most `samples` evenly spaced rows, as the sampled `Run.history`.
+
+        With `stream="system"`, system metrics sampled every
+        `system_interval` seconds over the runtime of the history. Takes one
+        page of latency however many rows are sampled.
+        """
+        time.sleep(self.page_latency)
+        if stream == "system":
+            count = int(self.num_steps * SECONDS_PER_STEP // self.system_interval) + 1
+            row = self.system_row
+        else:
+            count = self.num_steps
+            row = self.row
+        if count <= samples:
+            indices = range(count)
+        else:
+            # Like the server, exactly `samples` rows, first and last kept.
+            spacing = (count - 1) / max(samples - 1, 1)
+            indices = sorted({round(i * spacing) for i in range(samples)})
+        rows = [row(i) for i in indices]
+        return pd.DataFrame.from_records(rows) if pandas else rows
+
+
+class FakeApi:
+    def __init__(
+        self,
+        runs: typing.Iterable[FakeRun],
+        page_latency: float = 0.0,
+        timeout: int | None = None,
+    ):
+        """Stand-in for `wandb.Api` serving `runs`.
+
+        Use `functools.partial(FakeApi, runs)` in place of `wandb.Api`.
+
+        Args:
+            runs (typing.Iterable[FakeRun]): Runs to serve.
+            page_latency (float): Seconds to sleep for each page of runs
+                listed. Default 0.
+            timeout (int | None): Ignored, accepted for compatibility.
+        """
+        self._runs = list(runs)
+        self.page_latency = page_latency
+
+    def runs(
+        self,
+        path: str,
+        filters: dict | None = None,
+        per_page: int = 50,
+        lazy: bool = True,
+    ) -> list[FakeRun]:
+        """Runs in the project at `path`. `filters` and `lazy` are ignored."""
+        runs = [run for run in self._runs if run.project == path]
+        for _ in range(0, max(len(runs), 1), per_page):
+            time.sleep(self.page_latency)
+        return runs
+
+
+def make_runs(
+    num_runs: int,
+    project: str = "bench/project",
+    **run_kwargs,
+) -> list[FakeRun]:
+    """`num_runs` runs with ids `run0`, `run1`, ... and different seeds."""
+    return [
+        FakeRun(f"run{i}", project=project, seed=i, **run_kwargs)
+        for i in range(num_runs)
+    ]
@@ -1,14 +1,9 @@
 import argparse
-import collections
 import logging
-import typing
 
-import constants
-import core
+import run_index
 import utils
 
-EVAL_REGEX = "^[a-z0-9]*_step_[0-9]*_.*"
-
 
 def cmd_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser("Find running jobs.")
@@ -26,74 +21,54 @@ def cmd_args() -> argparse.Namespace:
         "Wandb uses a default value if not specified.",
         default=None,
     )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        help="Use the local run index without querying wandb if it was refreshed"
+        " less than this many seconds ago (default: %(default)s).",
+        default=60,
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Rebuild the local run index from all running runs.",
+    )
     utils.add_log_level_arg(parser, default="info")
     return parser.parse_args()
 
 
-def train_run_id_from_eval_id(s: str) -> str:
-    return s.split("_")[0]
-
-
-def duplicates(lst: list[typing.Any]) -> list[typing.Any]:
-    counts = collections.Counter(lst)
-    return [k for k, count in counts.items() if count > 1]
-
-
 if __name__ == "__main__":
     args = cmd_args()
     logger = logging.getLogger()
     logging.basicConfig(level=args.log_level)
 
-    eval_query_filter = {
-        "$and": [
-            {"displayName": {"$regex": EVAL_REGEX}},
-            {"state": "running"},
-        ]
-    }
-    if args.username is not None:
-        eval_query_filter["$and"].append({"username": args.username})
-
-    logging.info("Fetching ongoing eval runs.")
-    eval_running = core.fetch_runs(
-        path=constants.Paths.EVAL,
-        timeout=args.timeout,
-        query_filter=eval_query_filter,
-    )
-
-    logging.info("Fetching ongoing training runs.")
-    train_running = utils.get_train_running(
-        username=args.username,
-        timeout=args.timeout,
-    )
-
-    eval_names = [run.name for run in eval_running]
-    train_running_ids = {run.id for run in train_running}
-    trains_with_eval = [train_run_id_from_eval_id(s) for s in eval_names]
-    duplicated_evals = duplicates(trains_with_eval)
-    trains_with_eval = set(trains_with_eval)
+    index = run_index.RunIndex(timeout=args.timeout)
+    if args.rebuild:
+        logging.info("Rebuilding run index.")
+        index.refresh(rebuild=True)
+    else:
+        index.ensure_fresh(args.max_age)
+    logging.info("Run index last refreshed %.0f seconds ago.", index.age())
 
     def print_row(run):
-        print(f"{run.name:<110} {run.id:>10}")
+        print(f"{run['name']:<110} {run['id']:>10}")
 
     print("Train running:")
-    for run in train_running:
+    for run in index.train_running(args.username):
         print_row(run)
     print()
     print("Eval running:")
-    for run in eval_running:
+    for run in index.eval_running(args.username):
         print_row(run)
     print()
     print("Training runs without running evals:")
-    for run in train_running:
-        if run.id not in trains_with_eval:
-            print_row(run)
+    for run in index.trains_without_evals(args.username):
+        print_row(run)
     print()
     print("Eval runs on training runs which aren't running:")
-    for run in eval_running:
-        train_run_id = train_run_id_from_eval_id(run.name)
-        if train_run_id not in train_running_ids:
-            print_row(run)
+    for run in index.orphan_evals(args.username):
+        print_row(run)
     print()
     print("Train ids with more than one eval running:")
-    for id_ in duplicated_evals:
+    for id_ in index.duplicate_evals(args.username):
         print(id_)
@@ -0,0 +1,304 @@
+"""Share run histories between processes through memory-mapped files.
+
+A server process (this script, or `watch.py --serve`) publishes the numeric
+columns of hot run histories as `.npy` files in a shared memory directory
+(`/dev/shm` where available) and keeps them up to date. Notebook kernels read
+them with `HistoryClient`, which memory-maps the files read-only, so every
+kernel shares one copy of the data in RAM however many attach.
+
+```
+python history_server.py <config-name> --wait 300
+```
+then, in a notebook,
+```
+client = history_server.HistoryClient()
+df = client.get(run.id)
+```
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import typing
+
+try:
+    import fcntl
+except ImportError:  # Windows, store directories are not locked.
+    fcntl = None
+
+import core
+import lazy
+import utils
+
+np = lazy.lazy_import("numpy")
+pd = lazy.lazy_import("pandas")
+wandb = lazy.lazy_import("wandb")
+
+logger = logging.getLogger(__name__)
+
+_MANIFEST = "manifest.json"
+_LOCK = ".lock"
+
+
+def default_store_dir() -> str:
+    """`/dev/shm/viz-history` if there is a `/dev/shm`, else in the temp dir."""
+    root = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(root, "viz-history")
+
+
+def _read_manifest(store_dir: str) -> dict[str, dict[str, typing.Any]]:
+    try:
+        with open(os.path.join(store_dir, _MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class HistoryStore:
+    def __init__(self, store_dir: str | None = None):
+        """Publish run histories for `HistoryClient`s to map.
+
+        Only one store can publish to a directory at a time, as each removes
+        files it doesn't know about. The store holds a lock on the directory
+        until `close`, which also removes everything it published. Use it as
+        a context manager so that happens on exit.
+
+        Args:
+            store_dir (str | None): Directory to publish to, ideally on a
+                memory backed filesystem. Default `default_store_dir()`.
+
+        Raises:
+            RuntimeError: If another store is publishing to `store_dir`.
+        """
+        self.store_dir = default_store_dir() if store_dir is None else store_dir
+        os.makedirs(self.store_dir, mode=0o755, exist_ok=True)
+        self._lock_fd = os.open(
+            os.path.join(self.store_dir, _LOCK), os.O_RDWR | os.O_CREAT, 0o644
+        )
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(self._lock_fd)
+                raise RuntimeError(
+                    f"Another store is publishing to {self.store_dir}."
+                ) from None
+        self.manifest = _read_manifest(self.store_dir)
+
+    def __enter__(self) -> HistoryStore:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop publishing all histories and release the store directory."""
+        if self._lock_fd is None:
+            return
+        try:
+            self.clear()
+        finally:
+            # Closing the file releases the lock.
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def publish(self, run_id: str, df: pd.DataFrame) -> bool:
+        """Publish the numeric columns of `df` as the history of `run_id`.
+
+        Non-numeric columns are left out. Nothing is written if the run's
+        published history already has as many rows and the same columns.
+        The previous version's file is removed; clients that already mapped
+        it keep a valid mapping until they next call `HistoryClient.get`.
+
+        Args:
+            run_id (str): The run id.
+            df (pd.DataFrame): The run's history.
+
+        Returns:
+            bool: Whether a new version was published.
+        """
+        numeric = df.select_dtypes(include=["number", "bool"])
+        columns = [str(c) for c in numeric.columns]
+        entry = self.manifest.get(run_id)
+        if entry is not None and (entry["rows"], entry["columns"]) == (
+            len(numeric),
+            columns,
+        ):
+            return False
+
+        version = 0 if entry is None else entry["version"] + 1
+        file_name = f"{run_id}.{version}.npy"
+        # Stored column-major so the client's frame is a zero-copy view.
+        data = np.ascontiguousarray(numeric.to_numpy(dtype="float64").T)
+        tmp_path = os.path.join(self.store_dir, f".{file_name}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, os.path.join(self.store_dir, file_name))
+
+        self.manifest[run_id] = {
+            "file": file_name,
+            "columns": columns,
+            "rows": len(numeric),
+            "version": version,
+            "updated_at": time.time(),
+        }
+        self._write_manifest()
+        if entry is not None:
+            self._remove(entry["file"])
+        logger.debug("Published %d rows of run %s.", len(numeric), run_id)
+        return True
+
+    def remove(self, run_id: str) -> None:
+        """Stop publishing the history of `run_id`."""
+        entry = self.manifest.pop(run_id, None)
+        if entry is not None:
+            self._write_manifest()
+            self._remove(entry["file"])
+
+    def clear(self) -> None:
+        """Stop publishing all histories."""
+        for run_id in list(self.manifest):
+            self.remove(run_id)
+
+    def _remove(self, file_name: str) -> None:
+        try:
+            os.remove(os.path.join(self.store_dir, file_name))
+        except FileNotFoundError:
+            pass
+
+    def _write_manifest(self) -> None:
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.store_dir, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(self.manifest, f)
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, os.path.join(self.store_dir, _MANIFEST))
+
+
+class HistoryClient:
+    def __init__(self, store_dir: str | None = None):
+        """Read-only, zero-copy access to histories published by a `HistoryStore`.
+
+        Args:
+            store_dir (str | None): Directory the store publishes to.
+                Default `default_store_dir()`.
+        """
+        self.store_dir = default_store_dir() if store_dir is None else store_dir
+        self._frames: dict[str, tuple[int, pd.DataFrame]] = {}
+
+    def runs(self) -> list[str]:
+        """Ids of the runs currently published."""
+        return sorted(_read_manifest(self.store_dir))
+
+    def get(self, run_id: str) -> pd.DataFrame:
+        """The latest published history of `run_id`.
+
+        The frame is backed by a read-only memory map shared with every other
+        client, so modifying it in place raises; take a `.copy()` first if
+        you need to. Calling `get` again returns the newest version.
+
+        Raises:
+            KeyError: If `run_id` isn't published.
+        """
+        for attempt in range(3):
+            entry = _read_manifest(self.store_dir).get(run_id)
+            if entry is None:
+                raise KeyError(f"Run {run_id} is not published in {self.store_dir}.")
+            cached = self._frames.get(run_id)
+            if cached is not None and cached[0] == entry["version"]:
+                return cached[1]
+            path = os.path.join(self.store_dir, entry["file"])
+            try:
+                data = np.load(path, mmap_mode="r")
+                break
+            except FileNotFoundError:
+                # A newer version was published after we read the manifest.
+                if attempt == 2:
+                    raise
+        df = pd.DataFrame(data.T, columns=entry["columns"], copy=False)
+        self._frames[run_id] = (entry["version"], df)
+        return df
+
+
+def publish_histories(
+    store: HistoryStore,
+    runs: typing.Sequence[wandb.apis.public.Run],
+    histories: typing.Sequence[pd.DataFrame],
+) -> int:
+    """Publish `histories` of `runs` to `store`, returning how many changed.
+
+    Runs published earlier but not in `runs`, e.g. ones that stopped running,
+    are removed so the store only holds the runs being watched.
+    """
+    updated = sum(store.publish(run.id, df) for run, df in zip(runs, histories))
+    for run_id in set(store.manifest) - {run.id for run in runs}:
+        store.remove(run_id)
+    return updated
+
+
+def cmd_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Serve run histories to notebook kernels.")
+    parser.add_argument(
+        "name",
+        type=str,
+        help="Name of the config whose runs to serve.",
+        choices=core.config_names(),
+    )
+    parser.add_argument(
+        "--wait",
+        type=utils.validator_int_strict_positive("wait"),
+        help="How long to wait between checking for new data.",
+        default=5 * 60,
+    )
+    parser.add_argument(
+        "--store-dir",
+        type=str,
+        default=None,
+        help="Directory to publish histories to (default: %s)." % default_store_dir(),
+    )
+    parser.add_argument(
+        "--page-size",
+        type=utils.validator_int_strict_positive("--page-size"),
+        help="Number of rows to download per wandb query in `run.scan_history`",
+        default=100,
+    )
+    parser.add_argument(
+        "--max-threads",
+        type=utils.validator_int_strict_positive("--max-threads"),
+        default=1,
+        help="Maximum number of concurrent threads for download.",
+    )
+    utils.add_log_level_arg(parser, default="info")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = cmd_args()
+    logging.basicConfig(level=args.log_level)
+
+    cfg = core.get_config(args.name)
+    downloader = core.HistoryManager()
+    with HistoryStore(args.store_dir) as store:
+        logging.info(
+            "Serving histories of config %s from %s.", args.name, store.store_dir
+        )
+        while True:
+            runs = core.fetch_runs(
+                path=cfg.download_path,
+                timeout=cfg.read_timeout,
+                query_filter=cfg.query_filter(),
+                run_filter=cfg.run_filter(),
+            )
+            histories = downloader.fetch_histories(
+                runs, max_threads=args.max_threads, page_size=args.page_size
+            )
+            updated = publish_histories(store, runs, histories)
+            logging.info("Published %d updated histories.", updated)
+            logging.info("Waiting for %d seconds.", args.wait)
+            time.sleep(args.wait)
@@ -0,0 +1,213 @@
+"""Timings and counters for history downloads.
+
+`core.HistoryManager` records how long each run spends in each phase of a
+download, and how many rows and bytes it moved, in a `DownloadStats`. The
+stats can be exported as JSON or in the Prometheus textfile format.
+"""
+
+import collections
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import typing
+
+logger = logging.getLogger(__name__)
+
+LISTING = "listing"
+NETWORK = "network"
+PARSE = "parse"
+CACHE_READ = "cache_read"
+CACHE_WRITE = "cache_write"
+PHASES = (LISTING, NETWORK, PARSE, CACHE_READ, CACHE_WRITE)
+
+COUNTERS = ("rows", "bytes_read", "bytes_written", "retries")
+
+_PROMETHEUS_PREFIX = "viz_download"
+
+
+class DownloadStats:
+    def __init__(self, profile: bool = False):
+        """Thread-safe per-run and aggregate download timings and counters.
+
+        Args:
+            profile (bool): Also capture a cProfile profile and a
+                tracemalloc snapshot for each phase, see `dump_profiles`.
+                cProfile can only profile one phase at a time, so phases
+                that overlap with one being profiled (e.g. on other
+                download threads) are timed but not profiled. Default False.
+        """
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._profiling = False
+        self._profiles: dict[str, pstats.Stats] = {}
+        self._snapshots: dict[str, tracemalloc.Snapshot] = {}
+        if profile and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget everything recorded so far, except profiles."""
+        with self._lock:
+            self.started = time.time()
+            self.runs: dict[str, dict[str, float]] = collections.defaultdict(
+                lambda: collections.defaultdict(float)
+            )
+            self.totals: dict[str, float] = collections.defaultdict(float)
+
+    @contextlib.contextmanager
+    def phase(self, name: str, run_id: str | None = None) -> typing.Iterator[None]:
+        """Time the body of the `with` statement as phase `name` of `run_id`.
+
+        Args:
+            name (str): The phase, usually one of `PHASES`.
+            run_id (str | None): Run the time is spent on, None for work
+                that isn't for a single run, like listing runs.
+        """
+        profiler = self._start_profile()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                self._stop_profile(name, profiler)
+            self.add(run_id, **{f"{name}_seconds": elapsed})
+
+    def add(self, run_id: str | None = None, **counters: float) -> None:
+        """Add to counters, e.g. `add(run.id, rows=10, retries=1)`."""
+        with self._lock:
+            for key, value in counters.items():
+                self.totals[key] += value
+                if run_id is not None:
+                    self.runs[run_id][key] += value
+
+    def _start_profile(self) -> cProfile.Profile | None:
+        if not self.profile:
+            return None
+        with self._lock:
+            if self._profiling:
+                return None
+            self._profiling = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Some other profiler is active.
+            with self._lock:
+                self._profiling = False
+            return None
+        return profiler
+
+    def _stop_profile(self, name: str, profiler: cProfile.Profile) -> None:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        with self._lock:
+            self._profiling = False
+            if name in self._profiles:
+                self._profiles[name].add(profiler)
+            else:
+                self._profiles[name] = pstats.Stats(profiler)
+            self._snapshots[name] = snapshot
+
+    def dump_profiles(self, directory: str) -> None:
+        """Write `<phase>.pstats` and `<phase>.tracemalloc` files to `directory`.
+
+        Load them with `pstats.Stats(path)` and `tracemalloc.Snapshot.load(path)`.
+        """
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            for name, stats in self._profiles.items():
+                stats.dump_stats(os.path.join(directory, f"{name}.pstats"))
+            for name, snapshot in self._snapshots.items():
+                snapshot.dump(os.path.join(directory, f"{name}.tracemalloc"))
+        logger.info("Wrote download profiles to %s.", directory)
+
+    @staticmethod
+    def _with_rates(counters: dict[str, float]) -> dict[str, float]:
+        out = dict(counters)
+        seconds = sum(out.get(f"{p}_seconds", 0.0) for p in (NETWORK, PARSE))
+        if out.get("rows") and seconds > 0:
+            out["rows_per_sec"] = out["rows"] / seconds
+        return out
+
+    def summary(self) -> dict[str, typing.Any]:
+        """Aggregate and per-run stats.
+
+        `rows_per_sec` is rows over time spent in the network and parse
+        phases. Aggregate phase times are summed over threads, so can exceed
+        `wall_seconds`.
+        """
+        with self._lock:
+            totals = self._with_rates(self.totals)
+            runs = {run_id: self._with_rates(c) for run_id, c in self.runs.items()}
+            wall = time.time() - self.started
+        return {
+            "started": self.started,
+            "wall_seconds": wall,
+            "num_runs": len(runs),
+            "totals": totals,
+            "runs": runs,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.summary())
+
+    def to_prometheus(self) -> str:
+        """Aggregate stats in the Prometheus text exposition format."""
+        summary = self.summary()
+        totals = summary["totals"]
+        lines = [
+            f"# HELP {_PROMETHEUS_PREFIX}_phase_seconds_total"
+            " Time spent in each download phase, summed over threads.",
+            f"# TYPE {_PROMETHEUS_PREFIX}_phase_seconds_total counter",
+        ]
+        for phase in PHASES:
+            value = totals.get(f"{phase}_seconds", 0.0)
+            lines.append(
+                f'{_PROMETHEUS_PREFIX}_phase_seconds_total{{phase="{phase}"}} {value}'
+            )
+        for counter in COUNTERS:
+            lines.extend(
+                [
+                    f"# TYPE {_PROMETHEUS_PREFIX}_{counter}_total counter",
+                    f"{_PROMETHEUS_PREFIX}_{counter}_total {totals.get(counter, 0)}",
+                ]
+            )
+        lines.extend(
+            [
+                f"# TYPE {_PROMETHEUS_PREFIX}_runs gauge",
+                f"{_PROMETHEUS_PREFIX}_runs {summary['num_runs']}",
+                f"# TYPE {_PROMETHEUS_PREFIX}_rows_per_second gauge",
+                f"{_PROMETHEUS_PREFIX}_rows_per_second"
+                f" {totals.get('rows_per_sec', 0.0)}",
+                f"# TYPE {_PROMETHEUS_PREFIX}_wall_seconds gauge",
+                f"{_PROMETHEUS_PREFIX}_wall_seconds {summary['wall_seconds']}",
+            ]
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """Write `to_prometheus` to `path` atomically, for the node exporter."""
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, suffix=".tmp", delete=False
+        ) as f:
+            f.write(self.to_prometheus())
+        # The textfile collector usually runs as its own user.
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, path)
+
+    def write_json(self, path: str) -> None:
+        """Write `to_json` to `path`, or to stdout if `path` is "-"."""
+        if path == "-":
+            print(self.to_json())
+            return
+        with open(path, "w") as f:
+            f.write(self.to_json())
@@ -0,0 +1,273 @@
+"""Integrity checks for cached run histories.
+
+`scan_cache_file` looks for the ways a CSV cache goes wrong: writes cut off
+part way through a line, lines pandas can't parse, duplicated or missing
+`_step` rows, and columns whose values have drifted from numbers to strings.
+The bad steps are collected into ranges that `core.HistoryManager.repair_cache`
+refetches and splices back in, rather than re-downloading the whole history.
+
+Runs logged with explicit steps can have real gaps. Step ranges a complete
+scan or a refetch found empty are recorded in a `<run id>.empty.json` file next to the cache
+and are not reported as gaps again.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import tempfile
+import typing
+
+import lazy
+
+pd = lazy.lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+# A column is numeric with drifted values if at least this fraction of its
+# non-null values parse as numbers.
+_NUMERIC_FRACTION = 0.5
+
+# Read once, `os.umask` can only be read by setting it.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@dataclasses.dataclass
+class CacheReport:
+    """Problems found in the cache of one run.
+
+    Steps and ranges are inclusive.
+    """
+
+    run_id: str
+    path: str
+    rows: int = 0
+    truncated: bool = False
+    bad_lines: int = 0
+    missing_step_column: bool = False
+    duplicate_steps: list[int] = dataclasses.field(default_factory=list)
+    gaps: list[tuple[int, int]] = dataclasses.field(default_factory=list)
+    drifted_columns: list[str] = dataclasses.field(default_factory=list)
+    drifted_steps: list[int] = dataclasses.field(default_factory=list)
+    last_step: int | None = None
+
+    @property
+    def ok(self) -> bool:
+        return not (
+            self.truncated
+            or self.bad_lines
+            or self.missing_step_column
+            or self.duplicate_steps
+            or self.gaps
+            or self.drifted_columns
+        )
+
+    def repair_ranges(self) -> list[tuple[int, int]]:
+        """Merged inclusive step ranges to refetch to fix this cache."""
+        ranges = list(self.gaps)
+        ranges.extend((s, s) for s in self.duplicate_steps)
+        ranges.extend((s, s) for s in self.drifted_steps)
+        if self.truncated and self.last_step is not None:
+            ranges.append((self.last_step, self.last_step))
+        return merge_ranges(ranges)
+
+    def describe(self) -> str:
+        """One line summary of the problems, for printing."""
+        if self.ok:
+            return "ok"
+        problems = []
+        if self.missing_step_column:
+            problems.append("no _step column")
+        if self.truncated:
+            problems.append("truncated")
+        if self.bad_lines:
+            problems.append(f"{self.bad_lines} bad lines")
+        if self.duplicate_steps:
+            problems.append(f"{len(self.duplicate_steps)} duplicate steps")
+        if self.gaps:
+            missing = sum(hi - lo + 1 for lo, hi in self.gaps)
+            problems.append(f"{missing} missing steps in {len(self.gaps)} gaps")
+        if self.drifted_columns:
+            problems.append(f"schema drift in {len(self.drifted_columns)} columns")
+        return ", ".join(problems)
+
+
+@contextlib.contextmanager
+def atomic_write(
+    path: str, mode: str = "w", prefix: str | None = None
+) -> typing.Iterator[typing.IO]:
+    """Open a temporary file that replaces `path` once the block exits cleanly.
+
+    Readers never see a partly written file. The temporary file is made with
+    mode 0600, so it gets the permissions a plain `open` would have given it
+    before the rename, letting other users sharing the directory read it.
+
+    Args:
+        path (str): File to replace.
+        mode (str): "w" or "wb".
+        prefix (str | None): Prefix of the temporary file's name.
+    """
+    with tempfile.NamedTemporaryFile(
+        mode,
+        dir=os.path.dirname(path) or ".",
+        prefix=prefix,
+        suffix=".tmp",
+        delete=False,
+    ) as f:
+        try:
+            yield f
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.chmod(f.name, 0o666 & ~_UMASK)
+    os.replace(f.name, path)
+
+
+def merge_ranges(ranges: typing.Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Sorted inclusive ranges with overlapping and adjacent ones merged."""
+    merged: list[tuple[int, int]] = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def subtract_ranges(
+    ranges: list[tuple[int, int]], remove: list[tuple[int, int]]
+) -> list[tuple[int, int]]:
+    """Parts of inclusive `ranges` not covered by merged, sorted `remove`."""
+    out = []
+    for lo, hi in ranges:
+        for r_lo, r_hi in remove:
+            if r_hi < lo or r_lo > hi:
+                continue
+            if r_lo > lo:
+                out.append((lo, r_lo - 1))
+            lo = r_hi + 1
+            if lo > hi:
+                break
+        if lo <= hi:
+            out.append((lo, hi))
+    return out
+
+
+def empty_ranges_path(cache_path: str) -> str:
+    """Sidecar file recording step ranges confirmed empty for `cache_path`."""
+    return cache_path.removesuffix(".csv") + ".empty.json"
+
+
+def read_empty_ranges(cache_path: str) -> list[tuple[int, int]]:
+    """Inclusive step ranges the run is known not to have logged."""
+    try:
+        with open(empty_ranges_path(cache_path)) as f:
+            return [(lo, hi) for lo, hi in json.load(f)]
+    except FileNotFoundError:
+        return []
+    except (json.JSONDecodeError, TypeError, ValueError):
+        logger.warning("Ignoring unreadable %s.", empty_ranges_path(cache_path))
+        return []
+
+
+def add_empty_ranges(cache_path: str, ranges: typing.Iterable[tuple[int, int]]) -> None:
+    """Record `ranges` as confirmed empty for `cache_path`, atomically."""
+    merged = merge_ranges([*read_empty_ranges(cache_path), *ranges])
+    with atomic_write(empty_ranges_path(cache_path)) as f:
+        json.dump(merged, f)
+
+
+def _count_lines(path: str) -> tuple[int, bool]:
+    """Number of lines in `path` and whether it ends in a newline."""
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    ends_in_newline = last == b"\n"
+    return lines + (not ends_in_newline), ends_in_newline
+
+
+def step_gaps(steps: pd.Series, start: int = 0) -> list[tuple[int, int]]:
+    """Inclusive ranges of steps from `start` to the last of `steps` not in it."""
+    unique = steps.drop_duplicates().sort_values().reset_index(drop=True)
+    previous = unique.shift(fill_value=start - 1)
+    starts = unique[unique - previous > 1].index
+    return [(int(previous[i]) + 1, int(unique[i]) - 1) for i in starts]
+
+
+def _drift(df: pd.DataFrame) -> tuple[list[str], list[int]]:
+    """Mostly numeric columns with some non-numeric values, and their steps."""
+    columns = [c for c in df.columns if str(c).startswith("Unnamed: ")]
+    steps = set()
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column]):
+            continue
+        values = df[column].dropna()
+        if values.empty:
+            continue
+        numeric = pd.to_numeric(values, errors="coerce")
+        n_numeric = numeric.notna().sum()
+        if n_numeric < len(values) and n_numeric / len(values) >= _NUMERIC_FRACTION:
+            columns.append(column)
+            steps.update(df.loc[numeric[numeric.isna()].index, "_step"].astype(int))
+    return columns, sorted(steps)
+
+
+def scan_cache_file(path: str, check_schema: bool = True) -> CacheReport:
+    """Check a cached history CSV for damage.
+
+    Args:
+        path (str): The cache file, named `<run id>.csv`.
+        check_schema (bool): Also look for schema drift, which needs every
+            column parsed. Without it only `_step` is parsed. Default True.
+
+    Returns:
+        CacheReport: The problems found.
+    """
+    run_id = os.path.basename(path).removesuffix(".csv")
+    report = CacheReport(run_id=run_id, path=path)
+    if os.path.getsize(path) == 0:
+        report.truncated = True
+        report.missing_step_column = True
+        return report
+    n_lines, ends_in_newline = _count_lines(path)
+    report.truncated = not ends_in_newline
+
+    try:
+        df = pd.read_csv(
+            path,
+            on_bad_lines="skip",
+            usecols=None if check_schema else ["_step"],
+            low_memory=False,
+        )
+    except ValueError:
+        # `usecols` names a column that isn't there.
+        report.missing_step_column = True
+        return report
+    if "_step" not in df.columns:
+        report.missing_step_column = True
+        return report
+
+    report.rows = len(df)
+    # Quoted newlines in string values would also count here, but history
+    # values are almost always numbers.
+    report.bad_lines = max(0, n_lines - 1 - report.rows)
+    df = df.assign(_step=pd.to_numeric(df["_step"], errors="coerce")).dropna(
+        subset=["_step"]
+    )
+    steps = df["_step"].astype(int)
+    if steps.empty:
+        return report
+    report.last_step = int(steps.iloc[-1])
+    report.duplicate_steps = sorted(steps[steps.duplicated()].unique().tolist())
+    report.gaps = subtract_ranges(step_gaps(steps), read_empty_ranges(path))
+    if check_schema:
+        report.drifted_columns, report.drifted_steps = _drift(df)
+    return report
@@ -0,0 +1,39 @@
+"""Deferred imports, so command line tools start quickly.
+
+pandas, wandb and matplotlib each take a large fraction of a second to import.
+Modules bind them with `lazy_import` and the real import happens the first time
+an attribute is used, so e.g. `download.py --help` never pays for them.
+"""
+
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported on first attribute access.
+
+    Attribute lookups are forwarded to the real module on every access rather
+    than copied, so patches applied to the real module (e.g. in tests) are seen.
+    Importing goes through `importlib.import_module`, which holds the import
+    lock, so first use from several threads at once is safe.
+    """
+
+    def __getattr__(self, attr: str):
+        return getattr(importlib.import_module(self.__name__), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self.__name__!r}>"
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Return `name` if it is already imported, otherwise a `LazyModule` for it.
+
+    Args:
+        name (str): Absolute module name, e.g. "pandas" or "matplotlib.pyplot".
+
+    Returns:
+        types.ModuleType: The module, or a proxy that imports it when used.
+    """
+    module = sys.modules.get(name)
+    return LazyModule(name) if module is None else module
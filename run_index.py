@@ -0,0 +1,215 @@
+"""Persistent index of running train and eval runs.
+
+Eval runs are named after the training run they evaluate, see `EVAL_REGEX`.
+The index keeps the running runs of both `constants.Paths.EVAL` and
+`constants.Paths.TRAIN` on disk, so questions like "which training runs have
+no eval" can be answered without listing both projects on every call.
+"""
+
+from __future__ import annotations
+
+import collections
+import json
+import logging
+import os
+import time
+import typing
+
+import platformdirs
+
+import constants
+import core
+import integrity
+import lazy
+
+wandb = lazy.lazy_import("wandb")
+
+logger = logging.getLogger(__name__)
+
+EVAL_REGEX = "^[a-z0-9]*_step_[0-9]*_.*"
+
+_EVAL = "eval"
+_TRAIN = "train"
+
+
+def train_run_id_from_eval_id(s: str) -> str:
+    return s.split("_")[0]
+
+
+def duplicates(lst: list[typing.Any]) -> list[typing.Any]:
+    counts = collections.Counter(lst)
+    return [k for k, count in counts.items() if count > 1]
+
+
+def _run_record(run: wandb.apis.public.Run) -> dict[str, str]:
+    return {
+        "id": run.id,
+        "name": run.name,
+        "state": run.state,
+        "username": run.user.username,
+    }
+
+
+class RunIndex:
+    def __init__(
+        self,
+        index_path: str | None = None,
+        timeout: int | None = None,
+        rebuild_after: float = 60 * 60,
+    ):
+        """Index of running eval runs and the training runs they evaluate.
+
+        The index is stored as JSON and refreshed incrementally: after an
+        initial listing of all running runs, a refresh only lists runs
+        updated since the previous refresh and adds, updates or drops them
+        according to their state.
+
+        Args:
+            index_path (str | None): Where to store the index. If None, it
+                lives in a platform specific local cache directory.
+                Default None.
+            timeout (int | None): Timeout for wandb `Api.runs` calls.
+                Wandb uses a default value if not specified. Default None.
+            rebuild_after (float): Seconds after which a refresh lists all
+                running runs again rather than only updated ones, in case
+                any state change was missed. Default one hour.
+        """
+        if index_path is None:
+            index_path = os.path.join(
+                platformdirs.user_cache_dir(), "viz", "run_index.json"
+            )
+        self.index_path = index_path
+        self.timeout = timeout
+        self.rebuild_after = rebuild_after
+        self.built_at: float | None = None
+        self.refreshed_at: float | None = None
+        self.runs: dict[str, dict[str, dict[str, str]]] = {_EVAL: {}, _TRAIN: {}}
+        self.load()
+
+    def load(self) -> None:
+        """Load the index from disk, leaving it empty if there is none."""
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logger.debug("No run index found at %s.", self.index_path)
+            return
+        except json.JSONDecodeError:
+            logger.warning("Ignoring unreadable run index at %s.", self.index_path)
+            return
+        self.built_at = data["built_at"]
+        self.refreshed_at = data["refreshed_at"]
+        self.runs = data["runs"]
+
+    def save(self) -> None:
+        """Write the index to disk atomically."""
+        directory = os.path.dirname(self.index_path)
+        os.makedirs(directory, exist_ok=True)
+        data = {
+            "built_at": self.built_at,
+            "refreshed_at": self.refreshed_at,
+            "runs": self.runs,
+        }
+        with integrity.atomic_write(self.index_path) as f:
+            json.dump(data, f)
+
+    def age(self) -> float:
+        """Seconds since the last refresh, infinite if never refreshed."""
+        if self.refreshed_at is None:
+            return float("inf")
+        return time.time() - self.refreshed_at
+
+    def refresh(self, rebuild: bool = False) -> None:
+        """Update the index from wandb and save it.
+
+        The eval and train projects are listed concurrently.
+
+        Args:
+            rebuild (bool): List all running runs rather than only those
+                updated since the last refresh. Forced if the index has
+                never been built or was built more than `rebuild_after`
+                seconds ago. Default False.
+        """
+        started = time.time()
+        rebuild = (
+            rebuild
+            or self.built_at is None
+            or self.refreshed_at is None
+            or started - self.built_at > self.rebuild_after
+        )
+        if rebuild:
+            logger.debug("Rebuilding run index from all running runs.")
+            condition = {"state": constants.RunStatus.RUNNING}
+        else:
+            since = core.isoformat_utc(self.refreshed_at - core.REFRESH_SLACK_SECONDS)
+            logger.debug("Refreshing run index with runs updated since %s.", since)
+            condition = {"updatedAt": {"$gt": since}}
+
+        eval_filter = {"$and": [{"displayName": {"$regex": EVAL_REGEX}}, condition]}
+        by_path = core.fetch_runs_by_path(
+            {constants.Paths.EVAL: eval_filter, constants.Paths.TRAIN: condition},
+            timeout=self.timeout,
+        )
+        fetched = {
+            _EVAL: by_path[constants.Paths.EVAL],
+            _TRAIN: by_path[constants.Paths.TRAIN],
+        }
+
+        for kind, runs in fetched.items():
+            if rebuild:
+                self.runs[kind] = {}
+            for run in runs:
+                if run.state == constants.RunStatus.RUNNING:
+                    self.runs[kind][run.id] = _run_record(run)
+                else:
+                    self.runs[kind].pop(run.id, None)
+        if rebuild:
+            self.built_at = started
+        self.refreshed_at = started
+        self.save()
+
+    def ensure_fresh(self, max_age: float) -> None:
+        """Refresh the index if it is older than `max_age` seconds."""
+        if self.age() > max_age:
+            self.refresh()
+        else:
+            logger.debug("Run index is %.0f seconds old, not refreshing.", self.age())
+
+    def _select(self, kind: str, username: str | None) -> list[dict[str, str]]:
+        return [
+            record
+            for record in self.runs[kind].values()
+            if username is None or record["username"] == username
+        ]
+
+    def train_running(self, username: str | None = None) -> list[dict[str, str]]:
+        """Running training runs, optionally only those of `username`."""
+        return self._select(_TRAIN, username)
+
+    def eval_running(self, username: str | None = None) -> list[dict[str, str]]:
+        """Running eval runs, optionally only those of `username`."""
+        return self._select(_EVAL, username)
+
+    def trains_without_evals(
+        self, username: str | None = None
+    ) -> list[dict[str, str]]:
+        """Running training runs with no running eval."""
+        evaluated = {
+            train_run_id_from_eval_id(r["name"]) for r in self.eval_running(username)
+        }
+        return [r for r in self.train_running(username) if r["id"] not in evaluated]
+
+    def orphan_evals(self, username: str | None = None) -> list[dict[str, str]]:
+        """Running eval runs whose training run is not running."""
+        train_ids = {r["id"] for r in self.train_running(username)}
+        return [
+            r
+            for r in self.eval_running(username)
+            if train_run_id_from_eval_id(r["name"]) not in train_ids
+        ]
+
+    def duplicate_evals(self, username: str | None = None) -> list[str]:
+        """Ids of training runs with more than one running eval."""
+        return duplicates(
+            [train_run_id_from_eval_id(r["name"]) for r in self.eval_running(username)]
+        )
@@ -0,0 +1,555 @@
+"""Local columnar table of run summaries, configs and tags.
+
+Leaderboard questions like "best eip score across all SOTA runs" only need
+each run's summary and config, not its history. `SummaryStore` keeps one
+table per project on disk with a row per run and a column per summary metric
+(`summary.<key>`) and config value (`config.<key>`), so they can be filtered,
+sorted and ranked across thousands of runs without touching wandb.
+
+Tables hold the runs matching one MongoDB query filter, so each config gets
+its own. They are filled by `core.fetch_runs(..., summaries=store)`, which
+lists runs with their summaries and configs in bulk, or kept up to date with
+`SummaryStore.refresh`, which only lists runs updated since the last refresh.
+
+```
+python run_summaries.py sota --top "evaluation_Improvement probability over TabPFNv2/main score"
+```
+"""
+
+from __future__ import annotations
+
+import argparse
+import collections.abc
+import hashlib
+import json
+import logging
+import numbers
+import os
+import pickle
+import threading
+import time
+import types
+import typing
+
+import platformdirs
+
+import core
+import integrity
+import lazy
+import utils
+
+pd = lazy.lazy_import("pandas")
+wandb = lazy.lazy_import("wandb")
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "summary."
+CONFIG_PREFIX = "config."
+
+WhereType = typing.Union[str, typing.Callable[["pd.DataFrame"], "pd.Series"]]
+
+
+def _flatten(
+    prefix: str, values: typing.Mapping[str, typing.Any], out: dict[str, typing.Any]
+) -> None:
+    """Add `values` to `out` as `prefix + key` columns, nested keys joined by ".".
+
+    Logged media and histograms (dicts with a `_type`) are left out, and
+    other non-scalar values are stored as strings.
+    """
+    for key, value in values.items():
+        if isinstance(value, typing.Mapping):
+            if "_type" not in value:
+                _flatten(f"{prefix}{key}.", value, out)
+        elif value is None or isinstance(value, (str, bool, numbers.Number)):
+            out[f"{prefix}{key}"] = value
+        else:
+            out[f"{prefix}{key}"] = str(value)
+
+
+def run_record(run: wandb.apis.public.Run) -> dict[str, typing.Any]:
+    """The row of `run` in the summary table."""
+    record = {
+        "id": run.id,
+        "name": run.name,
+        "state": run.state,
+        "project": run.project,
+        "username": run.user.username,
+        "user_name": run.user.name,
+        "tags": tuple(run.tags),
+        "created_at": getattr(run, "created_at", None),
+        "heartbeat_at": getattr(run, "heartbeat_at", None),
+    }
+    _flatten(SUMMARY_PREFIX, run.summary_metrics, record)
+    _flatten(CONFIG_PREFIX, run.config, record)
+    return record
+
+
+def _filter_key(query_filter: core.QueryFilterType | None) -> str:
+    """Short stable name for `query_filter`, "all" if None."""
+    if query_filter is None:
+        return "all"
+    dumped = json.dumps(query_filter, sort_keys=True, default=str)
+    return hashlib.sha1(dumped.encode()).hexdigest()[:12]
+
+
+class _PrefixedValues(collections.abc.Mapping):
+    """Non-null `prefix` columns of one row of a table, without the prefix.
+
+    Values are read when looked up, so filters that only look at a few keys
+    don't pay for every column of the table. `arrays` caches the columns
+    read as arrays, shared by the rows of one table.
+    """
+
+    def __init__(
+        self,
+        table: pd.DataFrame,
+        arrays: dict[str, typing.Any],
+        position: int,
+        prefix: str,
+    ):
+        self._table = table
+        self._arrays = arrays
+        self._position = position
+        self._prefix = prefix
+
+    def __getitem__(self, key: str) -> typing.Any:
+        column = self._prefix + key
+        array = self._arrays.get(column)
+        if array is None:
+            if column not in self._table.columns:
+                raise KeyError(key)
+            array = self._arrays[column] = self._table[column].to_numpy()
+        value = array[self._position]
+        if pd.isna(value):
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for column in self._table.columns:
+            if str(column).startswith(self._prefix):
+                key = column.removeprefix(self._prefix)
+                if key in self:
+                    yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+def _run_views(table: pd.DataFrame) -> typing.Iterator[types.SimpleNamespace]:
+    """Stand-ins for the `wandb.apis.public.Run`s of `table`'s rows, for run filters.
+
+    Each has the attributes run filters usually look at: `id`, `name`,
+    `state`, `project`, `tags`, `user.name`, `user.username`,
+    `summary_metrics` and `config`, the last two flattened as in the table
+    and read lazily.
+    """
+    base = table[["name", "state", "project", "tags", "user_name", "username"]]
+    arrays: dict[str, typing.Any] = {}
+    for position, row in enumerate(base.itertuples()):
+        yield types.SimpleNamespace(
+            id=row.Index,
+            name=row.name,
+            state=row.state,
+            project=row.project,
+            tags=list(row.tags),
+            user=types.SimpleNamespace(name=row.user_name, username=row.username),
+            summary_metrics=_PrefixedValues(table, arrays, position, SUMMARY_PREFIX),
+            config=_PrefixedValues(table, arrays, position, CONFIG_PREFIX),
+        )
+
+
+class SummaryStore:
+    def __init__(
+        self,
+        store_dir: str | None = None,
+        timeout: int | None = None,
+        rebuild_after: float = 24 * 60 * 60,
+    ):
+        """Summaries, configs and tags of runs, one table per project and filter.
+
+        Each table holds the runs matching one MongoDB query filter, and is
+        refreshed on its own, so configs listing different runs from the
+        same project don't overwrite each other. Tables are pickled
+        DataFrames indexed by run id, loaded once and reloaded only when
+        another process has written them.
+
+        Args:
+            store_dir (str | None): Where to store the tables. If None, in
+                a platform specific local cache directory. Default None.
+            timeout (int | None): Timeout for wandb `Api.runs` calls.
+                Wandb uses a default value if not specified. Default None.
+            rebuild_after (float): Seconds after which a refresh lists all
+                matching runs again rather than only updated ones, to drop
+                deleted runs and runs that no longer match. Default one day.
+        """
+        if store_dir is None:
+            store_dir = os.path.join(
+                platformdirs.user_cache_dir(), "viz", "run_summaries"
+            )
+        self.store_dir = store_dir
+        self.timeout = timeout
+        self.rebuild_after = rebuild_after
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._loaded: dict[str, tuple[int, dict[str, typing.Any]]] = {}
+
+    def get_store_path(
+        self, path: str, query_filter: core.QueryFilterType | None = None
+    ) -> str:
+        """File holding the table of runs in `path` matching `query_filter`."""
+        name = f"{path.replace('/', '__')}@{_filter_key(query_filter)}.pkl"
+        return os.path.join(self.store_dir, name)
+
+    def paths(self, query_filter: core.QueryFilterType | None = None) -> list[str]:
+        """Projects with a stored table for `query_filter`."""
+        suffix = f"@{_filter_key(query_filter)}.pkl"
+        return sorted(
+            name.removesuffix(suffix).replace("__", "/")
+            for name in os.listdir(self.store_dir)
+            if name.endswith(suffix)
+        )
+
+    def _load(
+        self, path: str, query_filter: core.QueryFilterType | None
+    ) -> dict[str, typing.Any]:
+        store_path = self.get_store_path(path, query_filter)
+        try:
+            mtime = os.stat(store_path).st_mtime_ns
+        except FileNotFoundError:
+            return {"built_at": None, "refreshed_at": None, "table": pd.DataFrame()}
+        loaded = self._loaded.get(store_path)
+        if loaded is None or loaded[0] != mtime:
+            with open(store_path, "rb") as f:
+                loaded = (mtime, pickle.load(f))
+            self._loaded[store_path] = loaded
+        return loaded[1]
+
+    def _save(
+        self,
+        path: str,
+        query_filter: core.QueryFilterType | None,
+        data: dict[str, typing.Any],
+    ) -> None:
+        store_path = self.get_store_path(path, query_filter)
+        with integrity.atomic_write(store_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._loaded[store_path] = (os.stat(store_path).st_mtime_ns, data)
+
+    def update(
+        self,
+        path: str,
+        runs: typing.Iterable[wandb.apis.public.Run],
+        query_filter: core.QueryFilterType | None = None,
+        replace: bool = False,
+        refreshed_at: float | None = None,
+    ) -> None:
+        """Add or update the rows of `runs` in the table of `path` and `query_filter`.
+
+        Args:
+            path (str): The project the runs were listed from.
+            runs (typing.Iterable[wandb.apis.public.Run]): Runs listed with
+                their summaries and configs, e.g. with `lazy=False`.
+            query_filter (core.QueryFilterType | None): The MongoDB query the
+                runs were listed with. Default None, every run.
+            replace (bool): `runs` are every run matching `query_filter`, so
+                drop the others from the table. Default False.
+            refreshed_at (float | None): Time the listing started, if `runs`
+                are every matching run updated since the last refresh.
+                Default None.
+        """
+        records = [run_record(run) for run in runs]
+        new = pd.DataFrame.from_records(records)
+        if not new.empty:
+            new = new.set_index("id")
+        with self._lock:
+            data = dict(self._load(path, query_filter))
+            table = data["table"]
+            if replace or table.empty:
+                table = new
+            elif not new.empty:
+                table = pd.concat([table.drop(new.index, errors="ignore"), new])
+            data["table"] = table
+            if refreshed_at is not None:
+                data["refreshed_at"] = refreshed_at
+                if replace:
+                    data["built_at"] = refreshed_at
+            self._save(path, query_filter, data)
+        logger.debug("Stored summaries of %d runs of %s.", len(records), path)
+
+    def age(
+        self, path: str, query_filter: core.QueryFilterType | None = None
+    ) -> float:
+        """Seconds since the table of `path` and `query_filter` was refreshed."""
+        with self._lock:
+            refreshed_at = self._load(path, query_filter)["refreshed_at"]
+        return float("inf") if refreshed_at is None else time.time() - refreshed_at
+
+    def refresh(
+        self,
+        path: str,
+        query_filter: core.QueryFilterType | None = None,
+        rebuild: bool = False,
+    ) -> int:
+        """Update the table of `path` and `query_filter` with recently updated runs.
+
+        Args:
+            path (str): The project to refresh.
+            query_filter (core.QueryFilterType | None): MongoDB query the
+                table's runs match. Default None, every run.
+            rebuild (bool): List every matching run rather than only those
+                updated since the last refresh, dropping runs no longer
+                listed. Forced if the table has never been built or was
+                built more than `rebuild_after` seconds ago. Default False.
+
+        Returns:
+            int: Number of runs listed.
+        """
+        started = time.time()
+        with self._lock:
+            data = self._load(path, query_filter)
+        rebuild = (
+            rebuild
+            or data["built_at"] is None
+            or data["refreshed_at"] is None
+            or started - data["built_at"] > self.rebuild_after
+        )
+        filters = query_filter
+        if not rebuild:
+            since = core.isoformat_utc(
+                data["refreshed_at"] - core.REFRESH_SLACK_SECONDS
+            )
+            logger.debug("Refreshing summaries of %s updated since %s.", path, since)
+            condition = {"updatedAt": {"$gt": since}}
+            filters = (
+                condition
+                if query_filter is None
+                else {"$and": [query_filter, condition]}
+            )
+        api = wandb.Api(timeout=self.timeout)
+        runs = list(api.runs(path, filters=filters, lazy=False))
+        self.update(
+            path, runs, query_filter=query_filter, replace=rebuild, refreshed_at=started
+        )
+        return len(runs)
+
+    def ensure_fresh(
+        self,
+        path: str,
+        max_age: float,
+        query_filter: core.QueryFilterType | None = None,
+    ) -> None:
+        """Refresh the table of `path` and `query_filter` if older than `max_age`."""
+        if self.age(path, query_filter) > max_age:
+            self.refresh(path, query_filter=query_filter)
+
+    def table(
+        self,
+        path: str | typing.Sequence[str] | None = None,
+        query_filter: core.QueryFilterType | None = None,
+    ) -> pd.DataFrame:
+        """Stored runs matching `query_filter` of one, several or all projects.
+
+        Don't modify the returned frame in place, it is shared with the store.
+
+        Args:
+            path (str | typing.Sequence[str] | None): The projects, every
+                project with a table for `query_filter` if None. Default None.
+            query_filter (core.QueryFilterType | None): The MongoDB query the
+                runs were listed with. Default None, every run.
+        """
+        if path is None:
+            path = self.paths(query_filter)
+        elif isinstance(path, str):
+            path = [path]
+        with self._lock:
+            tables = [self._load(p, query_filter)["table"] for p in path]
+        tables = [t for t in tables if not t.empty]
+        if not tables:
+            return pd.DataFrame()
+        return tables[0] if len(tables) == 1 else pd.concat(tables)
+
+    def query(
+        self,
+        where: WhereType | None = None,
+        path: str | typing.Sequence[str] | None = None,
+        tags: typing.Iterable[str] = (),
+        sort_by: str | None = None,
+        ascending: bool = False,
+        limit: int | None = None,
+        columns: typing.Sequence[str] | None = None,
+        query_filter: core.QueryFilterType | None = None,
+        run_filter: core.RunFilterType | None = None,
+    ) -> pd.DataFrame:
+        """Select, sort and limit stored runs.
+
+        Args:
+            where (WhereType | None): Condition on rows, either a
+                `DataFrame.query` expression (quote column names with
+                backticks, e.g. "`summary.loss` < 0.1") or a callable
+                returning a boolean Series. Default None, all rows.
+            path (str | typing.Sequence[str] | None): Projects to query, all
+                if None. Default None.
+            tags (typing.Iterable[str]): Only runs with all of these tags.
+            sort_by (str | None): Column to sort by. Non-numeric values of a
+                mostly numeric column sort last. Default None.
+            ascending (bool): Sort order. Default False, largest first.
+            limit (int | None): Return at most this many rows. Default None.
+            columns (typing.Sequence[str] | None): Columns to return, all if
+                None. Default None.
+            query_filter (core.QueryFilterType | None): Query the table of
+                runs listed with this MongoDB query. Default None, every run.
+            run_filter (core.RunFilterType | None): Only runs it accepts,
+                called with a stand-in for the run, see `_run_views`.
+                Default None.
+
+        Returns:
+            pd.DataFrame: Matching runs, indexed by run id.
+        """
+        df = self.table(path, query_filter)
+        if df.empty:
+            return df
+        tags = set(tags)
+        if tags:
+            df = df[df["tags"].map(tags.issubset)]
+        if run_filter is not None:
+            df = df[[bool(run_filter(run)) for run in _run_views(df)]]
+        if where is not None:
+            df = df.query(where) if isinstance(where, str) else df[where(df)]
+        if sort_by is not None:
+            key = pd.to_numeric(df[sort_by], errors="coerce")
+            if key.isna().all():
+                key = df[sort_by]
+            order = key.sort_values(ascending=ascending, na_position="last").index
+            df = df.loc[order]
+        if limit is not None:
+            df = df.iloc[:limit]
+        if columns is not None:
+            df = df[list(columns)]
+        return df
+
+    def top_k(
+        self,
+        metric: str,
+        k: int = 10,
+        path: str | typing.Sequence[str] | None = None,
+        where: WhereType | None = None,
+        tags: typing.Iterable[str] = (),
+        ascending: bool = False,
+        query_filter: core.QueryFilterType | None = None,
+        run_filter: core.RunFilterType | None = None,
+    ) -> pd.DataFrame:
+        """The `k` runs with the largest (or smallest) value of `metric`.
+
+        Args:
+            metric (str): Summary metric, with or without the "summary."
+                prefix, or any other numeric column.
+            k (int): Number of runs. Default 10.
+            path (str | typing.Sequence[str] | None): Projects to rank, all
+                if None. Default None.
+            where (WhereType | None): Only rank rows matching this, see
+                `query`. Default None.
+            tags (typing.Iterable[str]): Only rank runs with all these tags.
+            ascending (bool): Return the smallest values instead. Default
+                False.
+            query_filter (core.QueryFilterType | None): Rank the table of
+                runs listed with this MongoDB query. Default None, every run.
+            run_filter (core.RunFilterType | None): Only rank runs it
+                accepts, see `query`. Default None.
+
+        Returns:
+            pd.DataFrame: Columns "name", "state", "tags" and `metric`,
+                best first. Runs without a numeric `metric` are left out.
+        """
+        df = self.query(
+            where=where,
+            path=path,
+            tags=tags,
+            query_filter=query_filter,
+            run_filter=run_filter,
+        )
+        column = metric if metric in df.columns else SUMMARY_PREFIX + metric
+        if column not in df.columns:
+            raise ValueError(f"No runs have a value for {metric}.")
+        values = pd.to_numeric(df[column], errors="coerce").dropna()
+        best = values.nsmallest(k) if ascending else values.nlargest(k)
+        return df.loc[best.index, ["name", "state", "tags"]].assign(**{column: best})
+
+
+def cmd_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Rank runs by a summary metric.")
+    parser.add_argument(
+        "name",
+        type=str,
+        help="Name of the config whose projects to query.",
+        choices=core.config_names(),
+    )
+    parser.add_argument(
+        "--top",
+        type=str,
+        required=True,
+        metavar="METRIC",
+        help="Summary metric to rank runs by.",
+    )
+    parser.add_argument(
+        "-k",
+        type=utils.validator_int_strict_positive("-k"),
+        default=10,
+        help="Number of runs to show (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--ascending",
+        action="store_true",
+        help="Show the runs with the smallest values.",
+    )
+    parser.add_argument(
+        "--tag",
+        action="append",
+        dest="tags",
+        default=[],
+        help="Only rank runs with this tag, can be given several times.",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=10 * 60,
+        help="Refresh summaries older than this many seconds (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="List every run again rather than only recently updated ones.",
+    )
+    utils.add_log_level_arg(parser, default="warning")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = cmd_args()
+    logging.basicConfig(level=args.log_level)
+
+    cfg = core.get_config(args.name)
+    paths = (
+        [cfg.download_path]
+        if isinstance(cfg.download_path, str)
+        else list(cfg.download_path)
+    )
+    query_filter = cfg.query_filter()
+    store = SummaryStore(timeout=cfg.read_timeout)
+    for path in paths:
+        if args.rebuild:
+            store.refresh(path, query_filter=query_filter, rebuild=True)
+        else:
+            store.ensure_fresh(path, args.max_age, query_filter=query_filter)
+    with pd.option_context("display.max_colwidth", 60, "display.width", 200):
+        print(
+            store.top_k(
+                args.top,
+                k=args.k,
+                path=paths,
+                tags=args.tags,
+                ascending=args.ascending,
+                query_filter=query_filter,
+                run_filter=cfg.run_filter(),
+            )
+        )
@@ -1,11 +1,22 @@
 # TODO(HE): fix this make package.
 import sys;
 sys.path.append("../")
+import concurrent.futures
+import os
+import tempfile
+import time
+import types
 import unittest
+from unittest import mock
 
+import matplotlib
 import pandas as pd
 
 import core
+import fake_wandb
+import wandb
+
+matplotlib.use("Agg")
 
 
 class MockRun:
@@ -15,7 +26,11 @@ class MockRun:
 class TestDownloader(unittest.TestCase):
     def setUp(self):
         self.run = MockRun()
-        self.downloader = core.HistoryDownloader(_login=False)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.downloader = core.HistoryManager(cache_dir=self.tmp.name, _login=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
 
     def test_read_write_cache(self):
         data = pd.DataFrame(
@@ -29,3 +44,274 @@ class TestDownloader(unittest.TestCase):
         self.downloader.write_cache(self.run, data)
         read = self.downloader.read_cache(self.run)
         pd.testing.assert_frame_equal(read, data)
+
+    def test_incremental_fetch_matches_full(self):
+        run = fake_wandb.FakeRun("inc", num_steps=120, num_metrics=3, sparsity=0.3)
+        full_run = fake_wandb.FakeRun(
+            "full", num_steps=200, num_metrics=3, sparsity=0.3
+        )
+        self.downloader.fetch_history(run, page_size=50)
+        run.grow(80)
+        incremental = self.downloader.fetch_history(run, page_size=50)
+        full = self.downloader.fetch_history(full_run, page_size=50)
+        pd.testing.assert_frame_equal(incremental, full)
+        pd.testing.assert_frame_equal(self.downloader.read_cache(run), full)
+
+    def test_write_is_atomic(self):
+        data = pd.DataFrame({"_step": [0, 1], "a": [1.0, 2.0]})
+        self.downloader.write_cache(self.run, data)
+        self.assertEqual(
+            [f for f in os.listdir(self.tmp.name) if f.endswith(".tmp")], []
+        )
+        # Same permissions as a plain write, so other users can share the cache.
+        plain = os.path.join(self.tmp.name, "plain.csv")
+        open(plain, "w").close()
+        self.assertEqual(
+            os.stat(self.downloader.get_cache_path(self.run)).st_mode,
+            os.stat(plain).st_mode,
+        )
+
+    def test_duplicate_runs(self):
+        run = fake_wandb.FakeRun("dup", num_steps=50, num_metrics=2)
+        first, second = self.downloader.fetch_histories([run, run], max_threads=2)
+        pd.testing.assert_frame_equal(first, second)
+
+    def test_process_pool_matches_threads(self):
+        runs = fake_wandb.make_runs(3, num_steps=150, num_metrics=3, sparsity=0.3)
+        expected = fake_wandb.make_runs(3, num_steps=250, num_metrics=3, sparsity=0.3)
+        self.downloader.fetch_histories(runs[:2], max_threads=2, processes=2)
+        for run in runs:
+            run.grow(100)
+        self.assertIsNone(
+            self.downloader.fetch_histories(
+                runs, max_threads=3, processes=2, return_data=False
+            )
+        )
+        # Counted in the workers.
+        self.assertEqual(self.downloader.stats.totals["rows"], 2 * 150 + 2 * 100 + 250)
+
+        # Up to date runs are read, not sent to a worker and rewritten.
+        written = self.downloader.stats.totals["bytes_written"]
+        again = self.downloader.fetch_histories(runs, processes=1)
+        self.assertEqual(self.downloader.stats.totals["bytes_written"], written)
+        self.assertEqual([len(df) for df in again], [250] * 3)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            threads = core.HistoryManager(cache_dir=cache_dir, _login=False)
+            for got, want in zip(
+                self.downloader.fetch_histories(runs, processes=2),
+                threads.fetch_histories(expected),
+            ):
+                pd.testing.assert_frame_equal(got, want)
+
+    def test_system_metrics_rollups(self):
+        run = fake_wandb.FakeRun("sys", num_steps=4000, system_interval=10)
+        self.downloader.fetch_system_metrics(run)
+        run.grow(3000)
+        raw = self.downloader.fetch_system_metrics(run)
+        self.assertEqual(len(raw), 3500 // 10 + 1)
+        self.assertTrue(raw["_timestamp"].is_monotonic_increasing)
+
+        for resolution in core.SYSTEM_RESOLUTIONS:
+            rolled = self.downloader.read_system_metrics(run, resolution=resolution)
+            expected = core.rollup_system_metrics(raw, resolution)
+            pd.testing.assert_frame_equal(rolled, expected, check_dtype=False)
+        self.assertIsNone(self.downloader.read_system_metrics(run).attrs["resolution"])
+        coarse = self.downloader.read_system_metrics(run, max_points=100)
+        self.assertEqual(coarse.attrs["resolution"], 60)
+        self.assertEqual(len(coarse), 3500 // 60 + 1)
+        # System metrics are not checked as histories.
+        self.assertEqual(self.downloader.scan_cache_dir(), [])
+
+        # Past `samples`, server-sampled data replaces the raw samples.
+        run.grow(2000)
+        sampled = self.downloader.fetch_system_metrics(run, samples=100)
+        self.assertTrue(sampled.attrs[core.SAMPLED])
+        self.assertLessEqual(len(sampled), 100)
+        self.assertFalse(os.path.exists(self.downloader.get_system_path(run)))
+        read = self.downloader.read_system_metrics(run)
+        self.assertTrue(read.attrs[core.SAMPLED])
+        self.assertEqual(len(read), len(sampled))
+        hourly = self.downloader.read_system_metrics(run, resolution=3600)
+        pd.testing.assert_frame_equal(
+            hourly, core.rollup_system_metrics(sampled, 3600), check_dtype=False
+        )
+
+    def test_concurrent_processes(self):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=4) as pool:
+            list(pool.map(_fetch_in_process, [self.tmp.name] * 4))
+        expected = fake_wandb.FakeRun("shared", num_steps=300, num_metrics=3)
+        full = core.HistoryManager(
+            cache_dir=tempfile.mkdtemp(dir=self.tmp.name), _login=False
+        ).fetch_history(expected, page_size=50)
+        pd.testing.assert_frame_equal(self.downloader.read_cache(expected), full)
+
+    def test_repair_refetches_damaged_ranges(self):
+        run = fake_wandb.FakeRun("damaged", num_steps=300, num_metrics=3, sparsity=0.2)
+        full = self.downloader.fetch_history(run, page_size=50)
+        path = self.downloader.get_cache_path(run)
+        with open(path) as f:
+            lines = f.readlines()
+        # Line i + 1 holds step i. Drop steps 10-19, duplicate step 50, add a
+        # line with too many fields and cut the last line short.
+        damaged = lines[:11] + lines[21:52] + lines[51:60] + ["1,2,3,4,5,6,7\n"]
+        damaged += lines[60:]
+        with open(path, "w") as f:
+            f.write("".join(damaged)[:-10])
+
+        report = self.downloader.scan_cache(run)
+        self.assertFalse(report.ok)
+        self.assertEqual(report.repair_ranges(), [(10, 19), (50, 50), (299, 299)])
+        rows_before = self.downloader.stats.summary()["totals"]["rows"]
+        self.assertTrue(self.downloader.repair_cache(run, page_size=50).ok)
+        rows_after = self.downloader.stats.summary()["totals"]["rows"]
+        self.assertEqual(rows_after - rows_before, 12)
+        pd.testing.assert_frame_equal(self.downloader.read_cache(run), full)
+
+    def test_repair_confirms_real_gaps(self):
+        run = EveryTenthStepRun("gappy", num_steps=100, num_metrics=2)
+        self.downloader.fetch_history(run, page_size=50)
+        run.grow(25)
+        self.downloader.fetch_history(run, page_size=50)
+        # Steps a complete scan skipped are known to be empty.
+        self.assertTrue(self.downloader.scan_cache(run).ok)
+
+        # Caches written before that are checked by refetching the gaps.
+        cache_path = self.downloader.get_cache_path(run)
+        os.remove(core.integrity.empty_ranges_path(cache_path))
+        report = self.downloader.scan_cache(run)
+        self.assertEqual(len(report.gaps), 12)
+        self.assertTrue(self.downloader.repair_cache(run, page_size=50).ok)
+        self.assertTrue(self.downloader.scan_cache(run).ok)
+        self.assertEqual(self.downloader.scan_cache_dir()[0].gaps, [])
+
+    def test_progressive_previews_replaced_by_full(self):
+        runs = fake_wandb.make_runs(3, num_steps=400, num_metrics=2, page_latency=0.01)
+        progressive = self.downloader.fetch_histories_progressive(
+            runs, samples=50, max_threads=3, page_size=20
+        )
+        self.assertTrue(all(progressive.sampled(run) for run in runs))
+        self.assertTrue(all(len(df) <= 50 for df in progressive.all_current()))
+        self.assertTrue(
+            os.path.exists(self.downloader.get_preview_path(runs[0]))
+        )
+        lines = list(core.LineGenerator(runs, progressive.data_df())("metric_0", 5))
+        self.assertTrue(all(line.attrs[core.SAMPLED] for _, (_, line) in lines))
+        fig, ax = core.plot_lines(lines, title="metric_0")
+        self.assertTrue(
+            all(t.get_text().endswith("(sampled)") for t in ax.get_legend().texts)
+        )
+        matplotlib.pyplot.close(fig)
+        full = progressive.wait()
+        self.assertFalse(any(progressive.sampled(run) for run in runs))
+        lines = core.LineGenerator(runs, progressive.data_df())("metric_0", 5)
+        self.assertFalse(any(line.attrs for _, (_, line) in lines))
+        self.assertEqual([len(df) for df in full], [400] * 3)
+        self.assertFalse(os.path.exists(self.downloader.get_preview_path(runs[0])))
+        # Cached runs start from their full history.
+        again = self.downloader.fetch_histories_progressive(runs, samples=50)
+        self.assertFalse(any(again.sampled(run) for run in runs))
+        again.wait()
+
+    def test_progressive_run_without_history(self):
+        runs = [
+            fake_wandb.FakeRun("started", num_steps=50, num_metrics=2),
+            fake_wandb.FakeRun("new", num_steps=0, num_metrics=2),
+        ]
+        progressive = self.downloader.fetch_histories_progressive(runs, samples=20)
+        self.assertEqual(len(progressive.current(runs[1])), 0)
+        lines = core.LineGenerator(runs, progressive.data_df())("metric_0", 5)
+        self.assertEqual([run.id for run, _ in lines], ["started"])
+        self.assertEqual([len(df) for df in progressive.wait()], [50, 0])
+
+
+class EveryTenthStepRun(fake_wandb.FakeRun):
+    """Logs with explicit steps, only every tenth one."""
+
+    def scan_history(self, *args, **kwargs):
+        return (
+            row
+            for row in super().scan_history(*args, **kwargs)
+            if row["_step"] % 10 == 0
+        )
+
+
+def _fetch_in_process(cache_dir):
+    run = fake_wandb.FakeRun("shared", num_steps=300, num_metrics=3)
+    core.HistoryManager(cache_dir=cache_dir, _login=False).fetch_history(
+        run, page_size=50
+    )
+
+
+class TestShardRuns(unittest.TestCase):
+    def test_shards_partition_runs(self):
+        runs = fake_wandb.make_runs(50)
+        shards = [core.shard_runs(runs, i, 3) for i in range(3)]
+        self.assertEqual(
+            sorted(r.id for s in shards for r in s), sorted(r.id for r in runs)
+        )
+        self.assertTrue(all(shards))
+        self.assertEqual(core.shard_runs(runs[::-1], 1, 3), shards[1][::-1])
+
+
+class MockApi:
+    delay = 0.2
+
+    def __init__(self, timeout=None):
+        pass
+
+    def runs(self, path, filters=None, per_page=50):
+        time.sleep(self.delay)
+        return [types.SimpleNamespace(id=f"{path}-{i}", project=path) for i in range(2)]
+
+
+class TestFetchRuns(unittest.TestCase):
+    def test_multiple_paths_concurrent(self):
+        paths = ["entity/a", "entity/b", "entity/c"]
+        with mock.patch("wandb.Api", MockApi):
+            start = time.perf_counter()
+            runs = core.fetch_runs(paths, timeout=None)
+            elapsed = time.perf_counter() - start
+        self.assertEqual(
+            [run.project for run in runs], [p for p in paths for _ in range(2)]
+        )
+        self.assertLess(elapsed, MockApi.delay * len(paths))
+
+
+class FlakyRun(fake_wandb.FakeRun):
+    """Fails once part way through its history scan."""
+
+    failed = False
+
+    def scan_history(self, *args, **kwargs):
+        for i, row in enumerate(super().scan_history(*args, **kwargs)):
+            if i == 30 and not self.failed:
+                self.failed = True
+                raise wandb.errors.CommError("Connection reset.")
+            yield row
+
+
+class TestDownloadStats(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.downloader = core.HistoryManager(cache_dir=self.tmp.name, _login=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_retry_resumes_and_is_counted(self):
+        run = FlakyRun("flaky", num_steps=100, num_metrics=2)
+        history = self.downloader.fetch_history(run, page_size=20)
+        self.assertEqual(history["_step"].tolist(), list(range(100)))
+        totals = self.downloader.stats.summary()["totals"]
+        self.assertEqual(totals["retries"], 1)
+        self.assertEqual(totals["rows"], 100)
+        self.assertGreater(totals["bytes_written"], 0)
+        for phase in ["network", "parse", "cache_write"]:
+            self.assertIn(f"{phase}_seconds", totals)
+        self.assertIn(
+            "viz_download_retries_total 1", self.downloader.stats.to_prometheus()
+        )
+        prom_path = os.path.join(self.tmp.name, "viz.prom")
+        self.downloader.stats.write_prometheus(prom_path)
+        self.assertEqual(os.stat(prom_path).st_mode & 0o777, 0o644)
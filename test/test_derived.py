@@ -0,0 +1,47 @@
+import sys
+sys.path.append("../")
+import unittest
+
+import pandas as pd
+
+import derived
+
+
+class TestDerived(unittest.TestCase):
+    def setUp(self):
+        self.mean = derived.WeightedMean("mean", ["a", "b"], [1.0, 3.0])
+        self.best = derived.CumulativeMax("best", "mean")
+
+    def test_weighted_mean_ignores_missing(self):
+        df = pd.DataFrame({"a": [1.0, 1.0, None], "b": [5.0, None, None]})
+        result = self.mean.compute(df, None)
+        pd.testing.assert_series_equal(
+            result, pd.Series([4.0, 1.0, float("nan")]), check_names=False
+        )
+
+    def test_incremental_matches_full(self):
+        df = pd.DataFrame(
+            {"a": [1.0, 4.0, None, 0.0, 2.0], "b": [1.0, None, 3.0, None, 2.0]}
+        )
+        metrics = [self.mean, self.best]
+        full = derived.add_derived_columns(df, None, metrics)
+        first = derived.add_derived_columns(df.iloc[:2], None, metrics)
+        second = derived.add_derived_columns(df.iloc[2:], first, metrics)
+        pd.testing.assert_frame_equal(pd.concat([first, second]), full)
+
+    def test_running_max_carried_over_batch_without_inputs(self):
+        df = pd.DataFrame(
+            {"a": [0.5, None, None, None], "b": [None, None, None, None], "c": 1.0}
+        )
+        metrics = [self.mean, self.best]
+        first = derived.add_derived_columns(df.iloc[:2], None, metrics)
+        # The second batch only has training metrics.
+        second = derived.add_derived_columns(df.iloc[2:][["c"]], first, metrics)
+        self.assertEqual(second["best"].tolist(), [0.5, 0.5])
+        full = derived.add_derived_columns(df, None, metrics)
+        self.assertEqual(full["best"].tolist(), [0.5] * 4)
+
+    def test_skips_unavailable(self):
+        df = pd.DataFrame({"c": [1.0]})
+        result = derived.add_derived_columns(df, None, [self.mean, self.best])
+        self.assertEqual(list(result.columns), ["c"])
@@ -0,0 +1,73 @@
+import sys
+sys.path.append("../")
+import os
+import tempfile
+import types
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import history_server
+
+
+class TestHistoryServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = history_server.HistoryStore(self.tmp.name)
+        self.client = history_server.HistoryClient(self.tmp.name)
+        self.df = pd.DataFrame(
+            {"_step": [0, 1, 2], "a": [0.5, None, 1.5], "name": ["x", "y", "z"]}
+        )
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_round_trip_is_read_only_view(self):
+        self.assertTrue(self.store.publish("run", self.df))
+        self.assertFalse(self.store.publish("run", self.df))
+        df = self.client.get("run")
+        pd.testing.assert_frame_equal(
+            df, self.df[["_step", "a"]].astype(float), check_flags=False
+        )
+        self.assertIs(self.client.get("run"), df)
+        self.assertFalse(np.asarray(df["a"]).flags.owndata)
+        with self.assertRaises(ValueError):
+            np.asarray(df["a"])[0] = 1.0
+
+    def test_new_version(self):
+        self.store.publish("run", self.df)
+        old = self.client.get("run")
+        self.store.publish("run", pd.concat([self.df, self.df.iloc[:1]]))
+        self.assertEqual(len(self.client.get("run")), 4)
+        # Frames already handed out stay valid.
+        self.assertEqual(len(old), 3)
+        self.assertEqual(old["a"].sum(), 2.0)
+
+    def test_missing_run(self):
+        self.store.publish("run", self.df)
+        self.store.remove("run")
+        self.assertEqual(self.client.runs(), [])
+        with self.assertRaises(KeyError):
+            self.client.get("run")
+
+    def test_publish_removes_stopped_runs(self):
+        running = [types.SimpleNamespace(id="a"), types.SimpleNamespace(id="b")]
+        history_server.publish_histories(self.store, running, [self.df] * 2)
+        self.assertEqual(self.client.runs(), ["a", "b"])
+        history_server.publish_histories(self.store, running[1:], [self.df])
+        self.assertEqual(self.client.runs(), ["b"])
+        self.assertEqual(
+            len([f for f in os.listdir(self.tmp.name) if f.endswith(".npy")]), 1
+        )
+
+    def test_one_store_per_directory(self):
+        with self.assertRaises(RuntimeError):
+            history_server.HistoryStore(self.tmp.name)
+        self.store.publish("run", self.df)
+        self.store.close()
+        self.assertFalse(any(f.endswith(".npy") for f in os.listdir(self.tmp.name)))
+        with history_server.HistoryStore(self.tmp.name) as store:
+            store.publish("run", self.df)
+        self.assertEqual(self.client.runs(), [])
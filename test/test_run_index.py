@@ -0,0 +1,62 @@
+import sys
+sys.path.append("../")
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import constants
+import run_index
+
+
+def make_run(id_, name, state="running", username="me"):
+    return types.SimpleNamespace(
+        id=id_, name=name, state=state, user=types.SimpleNamespace(username=username)
+    )
+
+
+class TestRunIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmp.name, "index.json")
+        self.listed = {
+            constants.Paths.TRAIN: [make_run("a", "train-a"), make_run("b", "train-b")],
+            constants.Paths.EVAL: [
+                make_run("e1", "a_step_10_x"),
+                make_run("e2", "a_step_20_x"),
+                make_run("e3", "c_step_10_x"),
+            ],
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def patch_listing(self):
+        return mock.patch(
+            "core.fetch_runs_by_path",
+            side_effect=lambda queries, timeout: {p: self.listed[p] for p in queries},
+        )
+
+    def test_queries(self):
+        with self.patch_listing():
+            run_index.RunIndex(self.index_path).refresh()
+        # Answered from disk without listing.
+        with mock.patch("core.fetch_runs_by_path") as fetch:
+            index = run_index.RunIndex(self.index_path)
+            index.ensure_fresh(max_age=60)
+            fetch.assert_not_called()
+        self.assertEqual([r["id"] for r in index.trains_without_evals()], ["b"])
+        self.assertEqual([r["id"] for r in index.orphan_evals()], ["e3"])
+        self.assertEqual(index.duplicate_evals(), ["a"])
+        self.assertEqual(index.trains_without_evals(username="someone-else"), [])
+
+    def test_incremental_refresh_drops_finished(self):
+        with self.patch_listing():
+            index = run_index.RunIndex(self.index_path)
+            index.refresh()
+            self.listed[constants.Paths.TRAIN] = [make_run("b", "train-b", "finished")]
+            self.listed[constants.Paths.EVAL] = []
+            index.refresh()
+        self.assertEqual([r["id"] for r in index.train_running()], ["a"])
+        self.assertEqual(len(index.eval_running()), 3)
@@ -0,0 +1,100 @@
+import sys
+sys.path.append("../")
+import functools
+import tempfile
+import unittest
+from unittest import mock
+
+import core
+import fake_wandb
+import run_summaries
+
+
+class TestSummaryStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.runs = fake_wandb.make_runs(5, project="a/b", num_steps=20)
+        self.runs[0].tags = ["sota"]
+        self.runs[3].tags = ["sota", "regression"]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def patch_api(self):
+        return mock.patch("wandb.Api", functools.partial(fake_wandb.FakeApi, self.runs))
+
+    def test_fetch_runs_captures_summaries(self):
+        store = run_summaries.SummaryStore(self.tmp.name)
+        with self.patch_api():
+            core.fetch_runs("a/b", timeout=None, summaries=store)
+
+        table = run_summaries.SummaryStore(self.tmp.name).table("a/b")
+        self.assertEqual(sorted(table.index), sorted(run.id for run in self.runs))
+        self.assertEqual(table.loc["run2", "config.seed"], 2)
+        self.assertEqual(table.loc["run2", "config.model.num_metrics"], 10)
+        self.assertEqual(
+            table.loc["run2", "summary.metric_0"],
+            self.runs[2].summary_metrics["metric_0"],
+        )
+
+        best = store.top_k("metric_0", k=2)
+        values = [run.summary_metrics["metric_0"] for run in self.runs]
+        self.assertEqual(best["summary.metric_0"].tolist(), sorted(values)[::-1][:2])
+        sota = store.query(tags=["sota"], sort_by="summary.metric_1", limit=1)
+        self.assertIn(sota.index[0], {"run0", "run3"})
+        low = store.query("`config.seed` < 2")
+        self.assertEqual(sorted(low.index), ["run0", "run1"])
+        low = store.query(
+            run_filter=lambda run: run.config["seed"] < 2
+            and "metric_0" in run.summary_metrics
+            and run.summary_metrics.get("missing") is None
+        )
+        self.assertEqual(sorted(low.index), ["run0", "run1"])
+
+    def test_incremental_refresh(self):
+        store = run_summaries.SummaryStore(self.tmp.name)
+        with self.patch_api():
+            store.refresh("a/b")
+            self.runs[1].grow(5)
+            listed = self.runs[1:2]
+            with mock.patch.object(
+                fake_wandb.FakeApi,
+                "runs",
+                autospec=True,
+                side_effect=lambda *args, **kwargs: listed,
+            ) as runs:
+                store.refresh("a/b")
+        self.assertIn("updatedAt", runs.call_args.kwargs["filters"])
+        table = store.table("a/b")
+        # Runs not updated since the last refresh are kept.
+        self.assertEqual(len(table), 5)
+        self.assertEqual(
+            table.loc["run1", "summary._step"], self.runs[1].lastHistoryStep
+        )
+
+    def test_filtered_tables_kept_apart(self):
+        store = run_summaries.SummaryStore(self.tmp.name)
+        tagged = {"tags": {"$all": ["sota"]}}
+        listings = {None: self.runs, "sota": [self.runs[0], self.runs[3]]}
+
+        def runs(api, path, filters=None, **kwargs):
+            return listings["sota" if "sota" in str(filters) else None]
+
+        with mock.patch.object(
+            fake_wandb.FakeApi, "runs", autospec=True, side_effect=runs
+        ), self.patch_api():
+            store.refresh("a/b", query_filter=tagged, rebuild=True)
+            store.ensure_fresh("a/b", 600, query_filter=None)
+        self.assertEqual(len(store.table("a/b")), 5)
+        self.assertEqual(sorted(store.table("a/b", tagged).index), ["run0", "run3"])
+
+        best = store.top_k(
+            "metric_0",
+            query_filter=tagged,
+            run_filter=lambda run: "regression" not in run.tags,
+        )
+        self.assertEqual(list(best.index), ["run0"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import sys
+sys.path.append("../")
+import os
+import subprocess
+import unittest
+
+import core
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["pandas", "wandb", "matplotlib", "tqdm"]
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+class TestStartup(unittest.TestCase):
+    def test_cli_imports_are_light(self):
+        code = (
+            "import sys, time\n"
+            "start = time.perf_counter()\n"
+            "import download, watch, find_running, check_cache\n"
+            "print(time.perf_counter() - start)\n"
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+        )
+        elapsed, heavy = run_python("-c", code).stdout.splitlines()
+        self.assertEqual(heavy, "")
+        self.assertLess(float(elapsed), 0.2)
+
+    def test_help_lists_configs(self):
+        out = run_python("download.py", "--help").stdout
+        for name in core._CONFIG_ENTRIES:
+            self.assertIn(name, out)
+
+    def test_config_entries_match_registry(self):
+        import configs
+
+        registered = {
+            name: f"{cls.__module__}:{cls.__qualname__}"
+            for name, cls in core._REGISTRY.items()
+            if cls.__module__ == configs.__name__
+        }
+        self.assertEqual(registered, core._CONFIG_ENTRIES)
+
+    def test_get_config_imports_module(self):
+        self.assertIsInstance(core.get_config("sota"), core.DownloadConfig)
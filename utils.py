@@ -1,10 +1,13 @@
+from __future__ import annotations
+
 import argparse
 import typing
 
-import wandb
-
 import core
 import constants
+import lazy
+
+wandb = lazy.lazy_import("wandb")
 
 
 def add_log_level_arg(parser: argparse.ArgumentParser, default: str) -> None:
@@ -37,6 +40,18 @@ def validator_int_strict_positive(argname: str) -> typing.Callable[[str], int]:
     return validator
 
 
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse a shard argument `i/N` into `(i, N)`, with `0 <= i < N`."""
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must look like i/N, got {value}.")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(
+            f"Shard must have 0 <= i < N, got {value}."
+        )
+    return index, count
+
 
 def get_train_running(
     username: str | None = None,
@@ -1,12 +1,16 @@
 import argparse
+import contextlib
 import logging
 import time
 
-import tqdm
-
 import core
+import history_server
+import instrumentation
+import lazy
 import utils
 
+tqdm = lazy.lazy_import("tqdm")
+
 
 def cmd_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser("Watch running training jobs and update cache.")
@@ -41,6 +45,29 @@ def cmd_args() -> argparse.Namespace:
         default=1,
         help="Maximum number of concurrent threads for download.",
     )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Publish the histories of the watched runs for notebook kernels to"
+        " map with `history_server.HistoryClient`.",
+    )
+    parser.add_argument(
+        "--prometheus-file",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="Write download timings and counters to PATH in the Prometheus"
+        " textfile format after each cycle.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar="DIR",
+        help="Write cProfile and tracemalloc data for each download phase to DIR."
+        " Phases are only profiled while no other phase is, so use with"
+        " --max-threads 1 for complete profiles.",
+    )
     utils.add_log_level_arg(parser, default="info")
     return parser.parse_args()
 
@@ -50,36 +77,52 @@ if __name__ == "__main__":
     logger = logging.getLogger()
     logging.basicConfig(level=args.log_level)
 
-    downloader = core.HistoryManager()
+    downloader = core.HistoryManager(profile=args.profile is not None)
+    # Removes the published histories on exit.
+    serving = history_server.HistoryStore() if args.serve else contextlib.nullcontext()
 
-    while True:
-        logger.info("Finding ongoing training runs.")
-        runs = utils.get_train_running(
-            username=args.username,
-            timeout=args.timeout,
-        )
-        message = ["Found ongoing runs"]
-        message.append("{:<75} {:>10}".format("Run Name", "Run ID"))
-        for run in runs:
-            message.append("{:<75} {:>10}".format(run.name, run.id))
-        logger.info("\n".join(message))
+    with serving as store:
+        while True:
+            logger.info("Finding ongoing training runs.")
+            with downloader.stats.phase(instrumentation.LISTING):
+                runs = utils.get_train_running(
+                    username=args.username,
+                    timeout=args.timeout,
+                )
+            message = ["Found ongoing runs"]
+            message.append("{:<75} {:>10}".format("Run Name", "Run ID"))
+            for run in runs:
+                message.append("{:<75} {:>10}".format(run.name, run.id))
+            logger.info("\n".join(message))
 
-        if args.max_threads == 1:
-            logging.info("Downloading run data serially.")
-            for run in tqdm.tqdm(runs, desc="Updating run data"):
-                downloader.fetch_history(
-                    run,
+            if args.max_threads == 1:
+                logging.info("Downloading run data serially.")
+                histories = [
+                    downloader.fetch_history(
+                        run,
+                        page_size=args.page_size,
+                        update_cache=True,
+                    )
+                    for run in tqdm.tqdm(runs, desc="Updating run data")
+                ]
+            else:
+                logging.info("Downloading run data on %d threads.", args.max_threads)
+                histories = downloader.fetch_histories(
+                    runs,
+                    max_threads=args.max_threads,
                     page_size=args.page_size,
                     update_cache=True,
                 )
-        else:
-            logging.info("Downloading run data on %d threads.", args.max_threads)
-            downloader.fetch_histories(
-                runs,
-                max_threads=args.max_threads,
-                page_size=args.page_size,
-                update_cache=True,
-            )
 
-        logging.info("Waiting for %d seconds.", args.wait)
-        time.sleep(args.wait)
+            if store is not None:
+                updated = history_server.publish_histories(store, runs, histories)
+                logging.info("Published %d updated histories.", updated)
+
+            logging.info("Download stats: %s", downloader.stats.to_json())
+            if args.prometheus_file is not None:
+                downloader.stats.write_prometheus(args.prometheus_file)
+            if args.profile is not None:
+                downloader.stats.dump_profiles(args.profile)
+
+            logging.info("Waiting for %d seconds.", args.wait)
+            time.sleep(args.wait)